@@ -1,57 +1,285 @@
-from flask import Flask, jsonify, request
-from psycopg2.extras import RealDictCursor, register_default_json, register_default_jsonb
+import gzip
+import os
+import re
+import time
+from datetime import date, timedelta
+
+from flask import Flask, Response, jsonify, request, send_file
+from psycopg2.extras import register_default_json, register_default_jsonb
 
 import enrich_brands
+from departements import dept_sql
+import snapshots
+
+_DEPT_RE = re.compile(r"^(?:\d{2,3}|2[AB])$")
 
 # On crée notre application web
 app = Flask(__name__)
 register_default_json(loads=None, globally=True)
 register_default_jsonb(loads=None, globally=True)
 
+def _json_array_sql(sql, order_by="t.id"):
+    """Enveloppe une requête pour que Postgres produise directement le tableau JSON final."""
+    return f"SELECT COALESCE(json_agg(t ORDER BY {order_by}), '[]'::json)::text FROM ({sql}) t"
+
+def _passthrough(sql, params=None):
+    """Exécute une requête renvoyant un seul texte JSON et le renvoie tel quel (ni décodage ni réencodage).
+
+    En-tête Server-Timing: db = connexion + requête, ser = construction de la réponse.
+    """
+    t0 = time.perf_counter()
+    conn = enrich_brands.get_read_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            body = cur.fetchone()[0]
+        t1 = time.perf_counter()
+        resp = Response(body.encode("utf-8"), mimetype="application/json")
+        t2 = time.perf_counter()
+        resp.headers["Server-Timing"] = f"db;dur={(t1 - t0) * 1000:.2f}, ser;dur={(t2 - t1) * 1000:.2f}"
+        return resp
+    finally:
+        conn.close()
+
 # On crée une route "/" (racine du site)
 @app.route("/")
 def home():
     return "Bienvenue sur mon API Flask !"
 
+STATION_FIELDS = (
+    "id", "code_postal", "ville", "adresse", "latitude", "longitude", "automate",
+    "brand_name", "brand_short_name", "generation",
+)
+_CP_PREFIX_RE = re.compile(r"^\d{1,5}$")
+
+def _csv_arg(name):
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    return [v.strip() for v in raw.split(",") if v.strip()]
+
 @app.route("/stations")
 def stations():
     limit = request.args.get("limit", type=int)
     if limit is not None and limit <= 0:
         return jsonify({"error": "limit must be a positive integer"}), 400
 
+    # Projection: id toujours renvoyé; "carburants" active l'agrégation des prix.
+    fields = _csv_arg("fields")
+    with_prices = True
+    cols = "s.*"
+    if fields is not None:
+        unknown = [f for f in fields if f not in STATION_FIELDS and f != "carburants"]
+        if unknown:
+            return jsonify({"error": f"unknown fields: {', '.join(unknown)}"}), 400
+        with_prices = "carburants" in fields
+        cols = ", ".join(f"s.{f}" for f in ["id"] + [f for f in fields if f in STATION_FIELDS and f != "id"])
+
+    where = []
+    params = {}
+    fuels = _csv_arg("carburant")
+    if fuels:
+        where.append(
+            "EXISTS (SELECT 1 FROM carburant_current cf WHERE cf.station_id = s.id AND cf.carburant = ANY(%(fuels)s))"
+        )
+        params["fuels"] = fuels
+
+    cp = request.args.get("cp")
+    if cp:
+        if not _CP_PREFIX_RE.match(cp):
+            return jsonify({"error": "cp must be a numeric prefix"}), 400
+        where.append("s.code_postal LIKE %(cp)s")  # idx_stations_cp_prefix (text_pattern_ops)
+        params["cp"] = cp + "%"
+
+    dept = request.args.get("dept")
+    if dept:
+        if not _DEPT_RE.match(dept.upper()):
+            return jsonify({"error": "invalid departement"}), 400
+        where.append(f"{dept_sql('s.code_postal')} = %(dept)s")  # idx_stations_dept
+        params["dept"] = dept.upper()
+
+    bbox = _csv_arg("bbox")
+    if bbox is not None:
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox)
+        except ValueError:
+            return jsonify({"error": "bbox must be min_lat,min_lon,max_lat,max_lon"}), 400
+        where.append("s.latitude BETWEEN %(min_lat)s AND %(max_lat)s AND s.longitude BETWEEN %(min_lon)s AND %(max_lon)s")
+        params.update(min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon)
+
+    if request.args.get("automate") == "1":
+        where.append("s.automate = 1")  # idx_stations_automate (partiel)
+
+    brand = request.args.get("brand")
+    if brand:
+        where.append("(lower(s.brand_short_name) = lower(%(brand)s) OR lower(s.brand_name) = lower(%(brand)s))")
+        params["brand"] = brand
+
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    if with_prices:
+        fuel_join = " AND c.carburant = ANY(%(fuels)s)" if fuels else ""
+        sql = f"""
+            SELECT
+              {cols},
+              COALESCE(
+                json_agg(
+                  json_build_object(
+                    'carburant', c.carburant,
+                    'prix_euro', c.prix_milli / 1000.0,
+                    'ts', c.ts
+                  )
+                ) FILTER (WHERE c.carburant IS NOT NULL),
+                '[]'::json
+              ) AS carburants
+            FROM stations s
+            LEFT JOIN carburant_current c
+              ON c.station_id = s.id{fuel_join}
+            {where_sql}
+            GROUP BY s.id
+            ORDER BY s.id
+        """
+    else:
+        sql = f"""
+            SELECT {cols}
+            FROM stations s
+            {where_sql}
+            ORDER BY s.id
+        """
+    if limit:
+        sql += " LIMIT %(limit)s"
+        params["limit"] = limit
+    return _passthrough(_json_array_sql(sql), params)
+
+# Flux incrémental: stations et prix modifiés depuis une génération d'import donnée.
+@app.route("/changes")
+def changes():
+    since = request.args.get("since", type=int)
+    if since is None or since < 0:
+        return jsonify({"error": "since must be a non-negative integer"}), 400
+
+    # Génération courante et stations modifiées dans la même requête (même snapshot MVCC).
+    sql = """
+        WITH gen AS (
+          SELECT COALESCE(MAX(id), 0) AS id FROM import_generations WHERE finished_at IS NOT NULL
+        ), changed AS (
+          SELECT station_id AS id FROM carburant_current, gen
+          WHERE generation > %(since)s AND generation <= gen.id
+          UNION
+          SELECT s.id FROM stations s, gen
+          WHERE s.generation > %(since)s AND s.generation <= gen.id
+        ), changed_rows AS (
+          SELECT
+            s.*,
+            COALESCE(
+              json_agg(
+                json_build_object(
+                  'carburant', c.carburant,
+                  'prix_euro', c.prix_milli / 1000.0,
+                  'ts', c.ts,
+                  'generation', c.generation
+                )
+              ) FILTER (WHERE c.carburant IS NOT NULL),
+              '[]'::json
+            ) AS carburants
+          FROM changed ch
+          JOIN stations s ON s.id = ch.id
+          CROSS JOIN gen
+          LEFT JOIN carburant_current c
+            ON c.station_id = s.id
+           AND c.generation > %(since)s AND c.generation <= gen.id
+          GROUP BY s.id
+        )
+        SELECT json_build_object(
+          'generation', (SELECT id FROM gen),
+          'since', %(since)s,
+          'stations', (SELECT COALESCE(json_agg(t ORDER BY t.id), '[]'::json) FROM changed_rows t)
+        )::text
+    """
+    return _passthrough(sql, {"since": since})
+
+# Statistiques pré-agrégées à l'import (table carburant_stats)
+@app.route("/stats")
+def stats():
+    scope = (request.args.get("dept") or "FR").upper()
+    if scope != "FR" and not _DEPT_RE.match(scope):
+        return jsonify({"error": "invalid departement"}), 400
+    carburant = request.args.get("carburant")
+
     sql = """
         SELECT
-          s.*,
-          COALESCE(
-            json_agg(
-              json_build_object(
-                'carburant', c.carburant,
-                'prix_euro', c.prix_milli / 1000.0,
-                'ts', c.ts
-              )
-            ) FILTER (WHERE c.carburant IS NOT NULL),
-            '[]'::json
-          ) AS carburants
-        FROM stations s
-        LEFT JOIN carburant_current c
-          ON c.station_id = s.id
-        GROUP BY s.id
-        ORDER BY s.id
+          scope AS dept,
+          carburant,
+          n,
+          min_milli / 1000.0 AS min_euro,
+          avg_milli / 1000.0 AS avg_euro,
+          p10_milli / 1000.0 AS p10_euro,
+          median_milli / 1000.0 AS median_euro,
+          p90_milli / 1000.0 AS p90_euro,
+          max_milli / 1000.0 AS max_euro,
+          generation,
+          computed_at
+        FROM carburant_stats
+        WHERE scope = %s
     """
-    if limit:
-        sql += " LIMIT %s"
+    params = [scope]
+    if carburant:
+        sql += " AND carburant = %s"
+        params.append(carburant)
+    return _passthrough(_json_array_sql(sql, order_by="t.carburant"), params)
 
-    conn = enrich_brands.get_db_conn()
+# Historique long terme: agrégats journaliers OHLC (table carburant_daily)
+@app.route("/history/<int:station_id>")
+def history(station_id):
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            if limit:
-                cur.execute(sql, (limit,))
-            else:
-                cur.execute(sql)
-            rows = cur.fetchall()
-        return jsonify(rows)
-    finally:
-        conn.close()
+        date_from = date.fromisoformat(request.args["from"]) if request.args.get("from") else date.today() - timedelta(days=365)
+        date_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else date.today()
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+
+    sql = """
+        SELECT
+          carburant,
+          day,
+          open_milli / 1000.0 AS open_euro,
+          high_milli / 1000.0 AS high_euro,
+          low_milli / 1000.0 AS low_euro,
+          close_milli / 1000.0 AS close_euro,
+          n_changes
+        FROM carburant_daily
+        WHERE station_id = %(station_id)s AND day BETWEEN %(from)s AND %(to)s
+    """
+    params = {"station_id": station_id, "from": date_from, "to": date_to}
+    carburant = request.args.get("carburant")
+    if carburant:
+        sql += " AND carburant = %(carburant)s"
+        params["carburant"] = carburant
+    return _passthrough(_json_array_sql(sql, order_by="t.carburant, t.day"), params)
+
+# Snapshot pré-calculé à l'import: aucun accès BDD ni travail JSON sur ce chemin.
+@app.route("/snapshot")
+@app.route("/snapshot/<dept>")
+def snapshot(dept=None):
+    if dept is not None and not _DEPT_RE.match(dept.upper()):
+        return jsonify({"error": "invalid departement"}), 400
+    target, manifest = snapshots.current_manifest()
+    if manifest is None:
+        return jsonify({"error": "snapshot not available"}), 503
+
+    name = "all" if dept is None else f"dept/{dept.upper()}"
+    meta = manifest["files"].get(name)
+    if meta is None:
+        return jsonify({"error": "unknown departement"}), 404
+    path = os.path.join(target, f"{name}.json.gz")
+
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        resp = send_file(path, mimetype="application/json", etag=meta["etag"], conditional=True, max_age=60)
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = send_file(gzip.open(path, "rb"), mimetype="application/json", etag=meta["etag"] + "-id",
+                         conditional=True, max_age=60)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["X-Snapshot-Version"] = manifest["version"]
+    return resp
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Archive compressée et dédupliquée des flux XML bruts (data/historique).
+
+Chaque snapshot est compressé (lzma) et n'est écrit que si son hash diffère du
+précédent. index.jsonl garde une ligne par fichier: horodatage, nom, sha256.
+
+Usage:
+  python archive.py find "2025-07-17 15:20"   -> fichier en vigueur à cette date
+  python archive.py prune                     -> applique la rétention
+  python archive.py import-legacy             -> compresse les anciens .xml bruts
+
+Variables optionnelles:
+  ARCHIVE_DIR=data/historique
+  ARCHIVE_KEEP_ALL_DAYS=7      -> tout garder sur cette période
+  ARCHIVE_KEEP_DAILY_DAYS=180  -> au-delà, un snapshot par jour; plus vieux = supprimé
+"""
+
+import bisect
+import hashlib
+import json
+import lzma
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+INDEX_NAME = "index.jsonl"
+FILE_FORMAT = "prix_essence_%Y-%m-%d_%H-%M-%S.xml.xz"
+TS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def archive_dir() -> Path:
+    return Path(os.getenv("ARCHIVE_DIR", "data/historique"))
+
+
+def load_index(base_dir=None):
+    path = Path(base_dir or archive_dir()) / INDEX_NAME
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda e: e["ts"])
+    return entries
+
+
+def _write_index(base: Path, entries):
+    tmp = base / f".{INDEX_NAME}.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(e) + "\n")
+    os.replace(tmp, base / INDEX_NAME)
+
+
+def _store(base: Path, content: bytes, when, digest):
+    """Écrit le fichier compressé et retourne son entrée d'index (sans toucher à l'index)."""
+    name = when.strftime(FILE_FORMAT)
+    tmp = base / f".{name}.{os.getpid()}"
+    tmp.write_bytes(lzma.compress(content, preset=6))
+    os.replace(tmp, base / name)
+    return {
+        "ts": when.strftime(TS_FORMAT),
+        "file": name,
+        "sha256": digest,
+        "bytes": (base / name).stat().st_size,
+        "raw_bytes": len(content),
+    }
+
+
+def archive_snapshot(content: bytes, when=None, base_dir=None, entries=None):
+    """Archive content si différent du dernier snapshot. Retourne l'entrée, ou None si doublon."""
+    base = Path(base_dir or archive_dir())
+    base.mkdir(parents=True, exist_ok=True)
+    when = when or datetime.now()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if entries is None:
+        entries = load_index(base)
+    if entries and entries[-1]["sha256"] == digest:
+        return None
+
+    entry = _store(base, content, when, digest)
+    with open(base / INDEX_NAME, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    entries.append(entry)
+    return entry
+
+
+def find_snapshot(when, base_dir=None, entries=None):
+    """Entrée en vigueur à `when` (dernier snapshot archivé <= when), ou None."""
+    if entries is None:
+        entries = load_index(base_dir)
+    keys = [e["ts"] for e in entries]
+    i = bisect.bisect_right(keys, when.strftime(TS_FORMAT))
+    return entries[i - 1] if i else None
+
+
+def read_snapshot(entry, base_dir=None) -> bytes:
+    return lzma.decompress((Path(base_dir or archive_dir()) / entry["file"]).read_bytes())
+
+
+def iter_snapshots(start=None, end=None, base_dir=None):
+    """Rejoue les snapshots archivés entre start et end (inclus), dans l'ordre."""
+    lo = start.strftime(TS_FORMAT) if start else ""
+    hi = end.strftime(TS_FORMAT) if end else "~"
+    for entry in load_index(base_dir):
+        if lo <= entry["ts"] <= hi:
+            yield entry, read_snapshot(entry, base_dir)
+
+
+def apply_retention(now=None, keep_all_days=7, keep_daily_days=180, base_dir=None):
+    """Garde tout sur keep_all_days, puis le dernier snapshot de chaque jour, puis supprime."""
+    base = Path(base_dir or archive_dir())
+    now = now or datetime.now()
+    all_after = (now - timedelta(days=keep_all_days)).strftime(TS_FORMAT)
+    daily_after = (now - timedelta(days=keep_daily_days)).strftime(TS_FORMAT)
+
+    entries = load_index(base)
+    kept = []
+    last_of_day = {}
+    for e in entries:
+        if e["ts"] >= all_after:
+            kept.append(e)
+        elif e["ts"] >= daily_after:
+            last_of_day[e["ts"][:10]] = e
+    kept = sorted(list(last_of_day.values()) + kept, key=lambda e: e["ts"])
+
+    kept_files = {e["file"] for e in kept}
+    removed = [e for e in entries if e["file"] not in kept_files]
+    _write_index(base, kept)
+    for e in removed:
+        try:
+            (base / e["file"]).unlink()
+        except FileNotFoundError:
+            pass
+    print(f"[archive] rétention: {len(kept)} gardés, {len(removed)} supprimés")
+    return removed
+
+
+def import_legacy(base_dir=None, batch=500):
+    """Intègre les anciens prix_essence_*.xml non compressés (fusion dans l'index par date) puis les supprime.
+
+    L'index est réécrit tous les `batch` fichiers, avant suppression des originaux de ce lot:
+    un arrêt en cours de route ne laisse jamais de .xz hors index ni d'original perdu.
+    """
+    base = Path(base_dir or archive_dir())
+    entries = load_index(base)
+    keys = [e["ts"] for e in entries]
+    done = dup = 0
+    pending = []
+
+    def flush():
+        _write_index(base, entries)
+        for p in pending:
+            p.unlink()
+        pending.clear()
+
+    for path in sorted(base.glob("prix_essence_*.xml")):
+        when = datetime.strptime(path.name, "prix_essence_%Y-%m-%d_%H-%M.xml")
+        ts = when.strftime(TS_FORMAT)
+        content = path.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        # Doublon si identique au snapshot qui le précède chronologiquement.
+        i = bisect.bisect_right(keys, ts)
+        if i and entries[i - 1]["sha256"] == digest:
+            dup += 1
+        else:
+            keys.insert(i, ts)
+            entries.insert(i, _store(base, content, when, digest))
+            done += 1
+        pending.append(path)
+        if len(pending) >= batch:
+            flush()
+    flush()
+    print(f"[archive] import legacy: {done} archivés, {dup} doublons supprimés")
+
+
+def main(argv):
+    cmd = argv[1] if len(argv) > 1 else "prune"
+    if cmd == "find" and len(argv) > 2:
+        entry = find_snapshot(datetime.fromisoformat(argv[2]))
+        print(json.dumps(entry, indent=2) if entry else "[archive] aucun snapshot avant cette date")
+    elif cmd == "prune":
+        apply_retention(
+            keep_all_days=int(os.getenv("ARCHIVE_KEEP_ALL_DAYS", "7")),
+            keep_daily_days=int(os.getenv("ARCHIVE_KEEP_DAILY_DAYS", "180")),
+        )
+    elif cmd == "import-legacy":
+        import_legacy()
+    else:
+        raise SystemExit(__doc__)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,211 @@
+# columnar.py
+"""Représentation colonnaire (array) d'un snapshot XML du flux prix-carburants.
+
+Une colonne par champ au lieu d'un dict par station et par prix: quelques objets
+Python pour tout l'import. Les écrivains BDD consomment des générateurs de tuples.
+"""
+
+import re
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+NO_MAJ = -1
+
+# Bornes de plausibilité (prix en millièmes d'euro, coordonnées en degrés).
+PRICE_MIN_MILLI = 300
+PRICE_MAX_MILLI = 4000
+PRICE_MAX_DEVIATION = 0.5  # écart relatif max à la médiane du carburant
+COORD_BOXES = (
+    (41.0, 51.5, -5.5, 10.0),     # métropole + Corse
+    (15.8, 16.6, -61.9, -60.9),   # Guadeloupe
+    (14.3, 14.9, -61.3, -60.8),   # Martinique
+    (2.0, 6.0, -54.7, -51.5),     # Guyane
+    (-21.5, -20.8, 55.2, 55.9),   # La Réunion
+    (-13.1, -12.6, 44.9, 45.4),   # Mayotte
+)
+
+
+def _clean(txt: str) -> str:
+    # Nettoie basiquement les textes XML pour éliminer les espaces multiples.
+    return re.sub(r'\s+', ' ', (txt or '').strip())
+
+
+def _to_epoch(dt):
+    return NO_MAJ if dt is None else int((dt - EPOCH).total_seconds())
+
+
+def _from_epoch(seconds, default):
+    return default if seconds == NO_MAJ else EPOCH + timedelta(seconds=seconds)
+
+
+class ColumnarSnapshot:
+    def __init__(self):
+        # Stations (une position par station)
+        self.station_id = array("i")
+        self.latitude = array("d")
+        self.longitude = array("d")
+        self.automate = array("b")
+        self.code_postal = []
+        self.ville = []
+        self.adresse = []
+        # Prix (une position par station x carburant)
+        self.price_station = array("i")  # position dans les colonnes stations
+        self.fuel = array("B")           # code dans self.fuels
+        self.prix_milli = array("i")
+        self.maj = array("q")            # secondes depuis EPOCH, NO_MAJ si absente
+        self.fuels = []
+        self._fuel_codes = {}
+        # Services
+        self.service_station = array("i")
+        self.service = array("H")
+        self.services = []
+        self._service_codes = {}
+
+    def __len__(self):
+        return len(self.station_id)
+
+    @property
+    def price_count(self):
+        return len(self.prix_milli)
+
+    @property
+    def service_count(self):
+        return len(self.service)
+
+    @staticmethod
+    def _code(name, names, codes):
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def add_station(self, sid, cp, ville, adresse, lat, lon, automate):
+        self.station_id.append(sid)
+        self.code_postal.append(cp)
+        self.ville.append(ville)
+        self.adresse.append(adresse)
+        self.latitude.append(lat)
+        self.longitude.append(lon)
+        self.automate.append(1 if automate else 0)
+        return len(self.station_id) - 1
+
+    def add_price(self, idx, fuel, prix_milli, maj_dt):
+        self.price_station.append(idx)
+        self.fuel.append(self._code(fuel, self.fuels, self._fuel_codes))
+        self.prix_milli.append(prix_milli)
+        self.maj.append(_to_epoch(maj_dt))
+
+    def add_service(self, idx, name):
+        self.service_station.append(idx)
+        self.service.append(self._code(name, self.services, self._service_codes))
+
+    # --- Générateurs de lignes pour les écrivains BDD
+
+    def station_rows(self, generation):
+        for i in range(len(self.station_id)):
+            yield (
+                self.station_id[i], self.ville[i], self.code_postal[i], self.adresse[i],
+                self.latitude[i], self.longitude[i], self.automate[i], generation,
+            )
+
+    def current_rows(self, now, generation):
+        for i in range(len(self.prix_milli)):
+            yield (
+                self.station_id[self.price_station[i]], self.fuels[self.fuel[i]], self.prix_milli[i],
+                now, _from_epoch(self.maj[i], now), generation,
+            )
+
+    def history_rows(self, now):
+        for i in range(len(self.prix_milli)):
+            yield (
+                self.station_id[self.price_station[i]], self.fuels[self.fuel[i]], self.prix_milli[i] / 1000,
+                now, _from_epoch(self.maj[i], now),
+            )
+
+    def daily_rows(self, now):
+        for i in range(len(self.prix_milli)):
+            prix = self.prix_milli[i]
+            yield (
+                self.station_id[self.price_station[i]], self.fuels[self.fuel[i]],
+                _from_epoch(self.maj[i], now).date(), prix, prix, prix, prix,
+            )
+
+    def service_rows(self, now):
+        for i in range(len(self.service)):
+            yield (self.station_id[self.service_station[i]], self.services[self.service[i]], now)
+
+    @property
+    def missing_maj(self):
+        return self.maj.count(NO_MAJ)
+
+    @property
+    def priced_station_count(self):
+        return len(set(self.price_station))
+
+    # --- Contrôles
+
+    def validate(self):
+        """Positions des prix aberrants et des stations aux coordonnées invalides."""
+        outliers = []
+        by_fuel = {}
+        for i, p in enumerate(self.prix_milli):
+            if p < PRICE_MIN_MILLI or p > PRICE_MAX_MILLI:
+                outliers.append(i)
+            else:
+                by_fuel.setdefault(self.fuel[i], array("i")).append(p)
+        medians = {f: sorted(col)[len(col) // 2] for f, col in by_fuel.items()}
+        flagged = set(outliers)
+        for i, p in enumerate(self.prix_milli):
+            m = medians.get(self.fuel[i])
+            if i not in flagged and m and abs(p - m) > PRICE_MAX_DEVIATION * m:
+                outliers.append(i)
+
+        bad_coords = []
+        for i, (lat, lon) in enumerate(zip(self.latitude, self.longitude)):
+            if not any(a <= lat <= b and c <= lon <= d for (a, b, c, d) in COORD_BOXES):
+                bad_coords.append(i)
+        return {"price_outliers": sorted(outliers), "bad_coords": bad_coords}
+
+
+def parse_xml(path) -> ColumnarSnapshot:
+    """Parse en flux (iterparse) directement vers les colonnes."""
+    snap = ColumnarSnapshot()
+    for _, pdv in ET.iterparse(str(path), events=("end",)):
+        if pdv.tag != "pdv":
+            continue
+        horaires = pdv.find("horaires")
+        idx = snap.add_station(
+            int(pdv.get("id")),
+            pdv.get("cp"),
+            (pdv.findtext("ville", default="") or "").strip(),
+            _clean(pdv.findtext("adresse", default="")),
+            float(pdv.get("latitude") or 0) / 100000,
+            float(pdv.get("longitude") or 0) / 100000,
+            horaires is not None and horaires.get("automate-24-24") == "1",
+        )
+
+        # Un carburant en double dans un pdv: la dernière valeur l'emporte.
+        prices = {}
+        for prix in pdv.findall("prix"):
+            nom = prix.get("nom")
+            val = prix.get("valeur")
+            if nom and val:
+                maj_dt = None
+                maj_str = prix.get("maj")
+                if maj_str:
+                    try:
+                        maj_dt = datetime.strptime(maj_str, "%Y-%m-%d %H:%M:%S")
+                    except ValueError:
+                        maj_dt = None
+                prices[nom] = (int(round(float(val.replace(",", ".")) * 1000)), maj_dt)
+        for nom, (prix_milli, maj_dt) in prices.items():
+            snap.add_price(idx, nom, prix_milli, maj_dt)
+
+        for s in pdv.findall("services/service"):
+            if s.text and s.text.strip():
+                snap.add_service(idx, s.text.strip())
+        pdv.clear()
+    return snap
@@ -10,59 +10,160 @@ from dotenv import load_dotenv
 import enrich_brands
 
 
-def dedup_batch(pair_limit=500, delete_limit=5000, sleep_s=0.3, max_batches=None):
-    conn = enrich_brands.get_db_conn()
-    conn.autocommit = False
+# Règles de dédup par table: clé de partition + ordre (la 1re ligne est conservée).
+SERVICES_DEDUP = {
+    "table": "services",
+    "partition_by": "station_id, service",
+    "order_by": "date_import DESC NULLS LAST, ctid DESC",
+    "unique_index": "idx_services_station_service",
+}
+CARBURANTS_DEDUP = {
+    "table": "carburants",
+    "partition_by": "station_id, carburant, (COALESCE(date_maj, date_import)::date)",
+    "order_by": "date_maj DESC NULLS LAST, date_import DESC, ctid DESC",
+    "unique_index": "idx_carburants_station_fuel_day",
+}
+
+
+def ensure_progress_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_progress (
+          job TEXT PRIMARY KEY,
+          last_key BIGINT NOT NULL,
+          updated_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+
+
+def _load_progress(cur, job):
+    cur.execute("SELECT last_key FROM maintenance_progress WHERE job = %s", (job,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _save_progress(cur, job, last_key):
+    cur.execute(
+        """
+        INSERT INTO maintenance_progress (job, last_key, updated_at) VALUES (%s, %s, NOW())
+        ON CONFLICT (job) DO UPDATE SET last_key = EXCLUDED.last_key, updated_at = EXCLUDED.updated_at
+        """,
+        (job, last_key),
+    )
+
+
+def _clear_progress(cur, job):
+    cur.execute("DELETE FROM maintenance_progress WHERE job = %s", (job,))
+
+
+def keyset_dedup(cur, spec, job=None, range_rows=5000, commit=None, sleep_s=0.0,
+                 max_batches=None, deadline=None, resume=True, log_prefix="[dedup]"):
+    """Dédup par fenêtres successives de station_id (keyset walk sur l'index station_id).
+
+    Chaque batch ne traite que sa plage (last_key, upper] : le coût reste constant
+    quelle que soit la taille de la table. La dernière clé traitée est enregistrée
+    dans maintenance_progress pour reprendre après interruption.
+
+    commit: callable appelé après chaque batch (None = tout reste dans la transaction
+    de l'appelant, ex. import parse). deadline: time.monotonic() à ne pas dépasser.
+    Retourne (total_deleted, finished).
+    """
+    table = spec["table"]
+    job = job or f"dedup:{table}"
+    ensure_progress_table(cur)
+
+    last_key = _load_progress(cur, job) if resume else None
+    if last_key is None:
+        last_key = -1
+    else:
+        print(f"{log_prefix} reprise {table} après station_id={last_key}")
+
     total_deleted = 0
     batch = 0
+    finished = False
+    while True:
+        # Borne haute de la fenêtre: station_id de la N-ième ligne après last_key.
+        cur.execute(
+            f"""
+            SELECT MAX(station_id) FROM (
+              SELECT station_id FROM {table}
+              WHERE station_id > %s
+              ORDER BY station_id
+              LIMIT %s
+            ) w
+            """,
+            (last_key, range_rows),
+        )
+        upper = cur.fetchone()[0]
+        if upper is None:
+            finished = True
+            break
+
+        cur.execute(
+            f"""
+            WITH ranked AS (
+              SELECT ctid,
+                     ROW_NUMBER() OVER (
+                       PARTITION BY {spec["partition_by"]}
+                       ORDER BY {spec["order_by"]}
+                     ) AS rn
+              FROM {table}
+              WHERE station_id > %s AND station_id <= %s
+            )
+            DELETE FROM {table}
+            WHERE station_id > %s AND station_id <= %s
+              AND ctid IN (SELECT ctid FROM ranked WHERE rn > 1)
+            """,
+            (last_key, upper, last_key, upper),
+        )
+        deleted = cur.rowcount or 0
+        last_key = upper
+        _save_progress(cur, job, last_key)
+        if commit:
+            commit()
+        total_deleted += deleted
+        batch += 1
+
+        print(f"{log_prefix} batch {batch} {table} station_id<={last_key} deleted={deleted} total_deleted={total_deleted}")
+
+        if max_batches is not None and batch >= max_batches:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"{log_prefix} budget temps atteint, reprise possible après station_id={last_key}")
+            break
+        if sleep_s:
+            time.sleep(sleep_s)
+
+    if finished:
+        _clear_progress(cur, job)
+        if commit:
+            commit()
+    return total_deleted, finished
+
+
+def dedup_batch(range_rows=5000, sleep_s=0.3, max_batches=None, resume=True, deadline=None):
+    conn = enrich_brands.get_db_conn()
+    conn.autocommit = False
 
     try:
         with conn.cursor() as cur:
-            while True:
-                cur.execute(
-                    """
-                    WITH dup_pairs AS (
-                      SELECT station_id, service
-                      FROM services
-                      GROUP BY station_id, service
-                      HAVING COUNT(*) > 1
-                      LIMIT %s
-                    ), kept AS (
-                      SELECT DISTINCT ON (s.station_id, s.service)
-                        s.ctid, s.station_id, s.service
-                      FROM services s
-                      JOIN dup_pairs d USING (station_id, service)
-                      ORDER BY s.station_id, s.service, s.date_import DESC NULLS LAST, s.ctid DESC
-                    ), to_delete AS (
-                      SELECT s.ctid
-                      FROM services s
-                      JOIN dup_pairs d USING (station_id, service)
-                      LEFT JOIN kept k ON k.ctid = s.ctid
-                      WHERE k.ctid IS NULL
-                      LIMIT %s
-                    )
-                    DELETE FROM services
-                    WHERE ctid IN (SELECT ctid FROM to_delete)
-                    RETURNING 1
-                    """,
-                    (pair_limit, delete_limit),
-                )
-                deleted = cur.rowcount or 0
-                conn.commit()
-                total_deleted += deleted
-                batch += 1
-
-                print(f"[dedup] batch {batch} deleted={deleted} total_deleted={total_deleted}")
-
-                if deleted == 0:
-                    break
-                if max_batches is not None and batch >= max_batches:
-                    break
-                time.sleep(sleep_s)
+            total_deleted, finished = keyset_dedup(
+                cur,
+                SERVICES_DEDUP,
+                range_rows=range_rows,
+                commit=conn.commit,
+                sleep_s=sleep_s,
+                max_batches=max_batches,
+                deadline=deadline,
+                resume=resume,
+            )
+        conn.commit()
     finally:
         conn.close()
 
-    print(f"[dedup] DONE total_deleted={total_deleted}")
+    print(f"[dedup] DONE total_deleted={total_deleted} finished={finished}")
+    return total_deleted, finished
 
 
 def create_unique_index():
@@ -82,15 +183,18 @@ def create_unique_index():
 
 def main():
     load_dotenv()
-    pair_limit = int(os.getenv("DEDUP_PAIR_LIMIT", "500"))
-    delete_limit = int(os.getenv("DEDUP_DELETE_LIMIT", "5000"))
+    range_rows = int(os.getenv("DEDUP_RANGE_ROWS", "5000"))
     sleep_s = float(os.getenv("DEDUP_SLEEP_S", "0.3"))
     max_batches_env = os.getenv("DEDUP_MAX_BATCHES")
     max_batches = int(max_batches_env) if max_batches_env else None
+    resume = (os.getenv("DEDUP_RESET") or "").strip().lower() not in {"1", "true", "yes", "on"}
 
     print(f"[dedup] start {datetime.utcnow().isoformat()}Z")
-    print(f"[dedup] pair_limit={pair_limit} delete_limit={delete_limit} sleep_s={sleep_s} max_batches={max_batches}")
-    dedup_batch(pair_limit=pair_limit, delete_limit=delete_limit, sleep_s=sleep_s, max_batches=max_batches)
+    print(f"[dedup] range_rows={range_rows} sleep_s={sleep_s} max_batches={max_batches} resume={resume}")
+    _, finished = dedup_batch(range_rows=range_rows, sleep_s=sleep_s, max_batches=max_batches, resume=resume)
+    if not finished:
+        print("[dedup] passe incomplète: index unique non créé (relancer pour reprendre).")
+        return
     print("[dedup] creating unique index concurrently...")
     create_unique_index()
     print("[dedup] done")
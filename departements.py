@@ -0,0 +1,23 @@
+# departements.py
+"""Code département dérivé du code postal (Corse 2A/2B, DROM-COM sur 3 caractères)."""
+
+
+def dept_sql(cp_col: str = "code_postal") -> str:
+    """Expression SQL immuable (utilisable dans un index) donnant le département."""
+    return f"""(CASE
+      WHEN {cp_col} IS NULL OR length({cp_col}) < 2 THEN NULL
+      WHEN left({cp_col}, 2) = '20' THEN CASE WHEN {cp_col} < '20200' THEN '2A' ELSE '2B' END
+      WHEN left({cp_col}, 2) IN ('97', '98') THEN left({cp_col}, 3)
+      ELSE left({cp_col}, 2)
+    END)"""
+
+
+def dept_from_cp(cp):
+    if not isinstance(cp, str) or len(cp.strip()) < 2:
+        return None
+    cp = cp.strip()
+    if cp[:2] == "20":
+        return "2A" if cp < "20200" else "2B"
+    if cp[:2] in ("97", "98"):
+        return cp[:3]
+    return cp[:2]
@@ -4,6 +4,7 @@
 import os
 import time
 import json
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
@@ -76,11 +77,112 @@ def get_db_conn():
         kwargs["sslmode"] = sslmode
     return psycopg2.connect(**kwargs)
 
+# --- Routage lecture: DATABASE_READ_URLS="dsn1,dsn2" (round-robin), sinon primaire.
+# Test local: DATABASE_URL=postgresql://localhost:5432/db DATABASE_READ_URLS=postgresql://localhost:5433/db
+_read_lock = threading.Lock()
+_read_next = 0
+_primary_state = {"at": 0.0, "generation": None, "finished_at": None}
+
+def _read_dsns():
+    raw = os.getenv("DATABASE_READ_URLS") or os.getenv("DATABASE_READ_URL") or ""
+    return [d.strip() for d in raw.split(",") if d.strip()]
+
+def _env_opt(name, cast):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+def _last_import(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT MAX(id), MAX(finished_at) FROM import_generations WHERE finished_at IS NOT NULL"
+        )
+        return cur.fetchone()
+
+def _primary_last_import(cache_s):
+    """Dernière génération/horodatage d'import du primaire (mis en cache cache_s secondes).
+
+    Primaire injoignable: on réutilise la dernière valeur connue (None, None si aucune,
+    le réplica est alors considéré frais) pour qu'une panne du primaire ne coupe pas les lectures.
+    """
+    with _read_lock:
+        if time.monotonic() - _primary_state["at"] < cache_s:
+            return _primary_state["generation"], _primary_state["finished_at"]
+    try:
+        conn = get_db_conn()
+        try:
+            generation, finished_at = _last_import(conn)
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        print(f"[db] primaire injoignable pour le contrôle de fraîcheur ({e.__class__.__name__}), dernière valeur connue")
+        with _read_lock:
+            # Pas de nouvelle tentative avant cache_s.
+            _primary_state["at"] = time.monotonic()
+            return _primary_state["generation"], _primary_state["finished_at"]
+    with _read_lock:
+        _primary_state.update(at=time.monotonic(), generation=generation, finished_at=finished_at)
+    return generation, finished_at
+
+def _is_stale(conn, max_lag_generations, max_staleness_s, cache_s):
+    generation, finished_at = _last_import(conn)
+    conn.rollback()
+    p_generation, p_finished_at = _primary_last_import(cache_s)
+    if max_lag_generations is not None and p_generation is not None:
+        if generation is None or p_generation - generation > max_lag_generations:
+            return f"generation={generation} primaire={p_generation}"
+    if max_staleness_s is not None and p_finished_at is not None:
+        if finished_at is None or (p_finished_at - finished_at).total_seconds() > max_staleness_s:
+            return f"import={finished_at} primaire={p_finished_at}"
+    return None
+
+def get_read_conn(max_lag_generations=None, max_staleness_s=None):
+    """Connexion lecture seule sur un réplica (round-robin), repli sur le primaire.
+
+    Contrôle de fraîcheur optionnel (READ_MAX_LAG_GENERATIONS / READ_MAX_STALENESS_S):
+    le réplica est écarté si son dernier import est en retard sur celui du primaire.
+    """
+    global _read_next
+    load_dotenv()
+    dsns = _read_dsns()
+    if not dsns:
+        return get_db_conn()
+    if max_lag_generations is None:
+        max_lag_generations = _env_opt("READ_MAX_LAG_GENERATIONS", int)
+    if max_staleness_s is None:
+        max_staleness_s = _env_opt("READ_MAX_STALENESS_S", float)
+    cache_s = float(os.getenv("READ_PRIMARY_CACHE_S", "5"))
+
+    with _read_lock:
+        start = _read_next
+        _read_next = (_read_next + 1) % len(dsns)
+    for i in range(len(dsns)):
+        dsn = dsns[(start + i) % len(dsns)]
+        try:
+            conn = psycopg2.connect(dsn, connect_timeout=5)
+        except psycopg2.OperationalError as e:
+            print(f"[db] réplica indisponible ({e.__class__.__name__}), suivant")
+            continue
+        conn.set_session(readonly=True)
+        if max_lag_generations is not None or max_staleness_s is not None:
+            try:
+                stale = _is_stale(conn, max_lag_generations, max_staleness_s, cache_s)
+            except psycopg2.Error as e:
+                stale = f"contrôle impossible: {e.__class__.__name__}"
+            if stale:
+                print(f"[db] réplica en retard ({stale}), suivant")
+                conn.close()
+                continue
+        return conn
+    return get_db_conn()
+
 def ensure_brand_columns(conn):
     cur = conn.cursor()
     # ✅ corrige la syntaxe : pas de "IF NOT EXISTS" après ALTER TABLE
     cur.execute("ALTER TABLE stations ADD COLUMN IF NOT EXISTS brand_name TEXT;")
     cur.execute("ALTER TABLE stations ADD COLUMN IF NOT EXISTS brand_short_name TEXT;")
+    # Filtre /stations?brand= (insensible à la casse)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stations_brand_short ON stations (lower(brand_short_name));")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stations_brand_name ON stations (lower(brand_name));")
     conn.commit()
     cur.close()
 
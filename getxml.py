@@ -1,8 +1,9 @@
-import os, requests, datetime
-from datetime import datetime
+import os, requests
 from zipfile import ZipFile
 from io import BytesIO
 
+import archive
+
 
 # 1. Importer les modules
 
@@ -32,8 +33,7 @@ def main():
     else :  
         print(f"Problème avec la récupération URL : code {response.status_code} ")
 
-    # On formate le nom du fichier à la date d'aujourd'hui et au bon format grâce a strftime
-    date_time_now = datetime.now().strftime("prix_essence_%Y-%m-%d_%H-%M")
+    # Le nom du fichier d'historique (horodaté) est formaté par archive.archive_snapshot
 
 
     # Comme c'est un fichier ZIP (binaire- d'ou l'utilisation de BytesIO) que l'on récupère depuis l'URL
@@ -51,9 +51,16 @@ def main():
             f.write(contenu_xml)
             print(f"Fichier sauvegardé : data/actuel/{nom_fichier_xml}")
 
-        with open(f"data/historique/{date_time_now}.xml", "wb") as f_hist:
-            f_hist.write(contenu_xml)
-            print(f"Fichier sauvegardé : data/historique/{date_time_now}.xml")
+        # Historique: compressé, ignoré si identique au snapshot précédent
+        entry = archive.archive_snapshot(contenu_xml)
+        if entry:
+            print(f"Fichier archivé : data/historique/{entry['file']} ({entry['bytes']} octets)")
+        else:
+            print("Snapshot identique au précédent : pas d'archive")
+        archive.apply_retention(
+            keep_all_days=int(os.getenv("ARCHIVE_KEEP_ALL_DAYS", "7")),
+            keep_daily_days=int(os.getenv("ARCHIVE_KEEP_DAILY_DAYS", "180")),
+        )
             
 
 
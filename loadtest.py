@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Banc de charge de l'API (app.py) sur une base Postgres locale jetable.
+
+Usage:
+  LOADTEST_DATABASE_URL=postgresql://localhost:5432/loadtest python loadtest.py --seed
+  python loadtest.py --mode inprocess --concurrency 1,4,16 --duration 20
+  python loadtest.py --mode wsgi --mix full:1,limit:6,dept:4,fuel:4,stats:2,snapshot:3 --json before.json
+
+Rapport par niveau de concurrence: débit, latences p50/p95/p99, temps BDD et
+temps de sérialisation moyens (lus dans l'en-tête Server-Timing de l'API).
+⚠️ --seed vide stations / services / carburant_current (et, par CASCADE, carburants) de la base de test.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import re
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import psycopg2
+import requests
+from dotenv import load_dotenv
+
+FUELS = (("Gazole", 0.97, 1750), ("SP95", 0.45, 1850), ("SP98", 0.75, 1930),
+         ("E10", 0.8, 1800), ("E85", 0.3, 850), ("GPLc", 0.15, 1000))
+BRANDS = (("TotalEnergies", "TOTAL"), ("Intermarché", "ITM"), ("Leclerc", "LECLERC"),
+          ("Carrefour", "CARREFOUR"), ("Auchan", "AUCHAN"), ("Esso", "ESSO"), (None, None))
+DEPTS = [f"{d:02d}" for d in range(1, 96) if d != 20] + ["2A", "2B"]
+
+DEFAULT_MIX = "full:1,limit:6,dept:4,fuel:4,stats:2,snapshot:3"
+_TIMING_RE = re.compile(r"(\w+);dur=([\d.]+)")
+
+
+def _dsn():
+    load_dotenv()
+    dsn = os.getenv("LOADTEST_DATABASE_URL")
+    if not dsn:
+        raise SystemExit("[loadtest] LOADTEST_DATABASE_URL requis (base locale jetable).")
+    return dsn
+
+
+def _use_loadtest_db(dsn):
+    # L'app lit DATABASE_PUBLIC_URL en priorité. load_dotenv (rappelé à chaque requête)
+    # n'écrase pas une clé présente: vides explicites plutôt que pop, sinon les
+    # réplicas de .env reviendraient.
+    os.environ["DATABASE_PUBLIC_URL"] = dsn
+    os.environ["DATABASE_READ_URLS"] = ""
+    os.environ["DATABASE_READ_URL"] = ""
+
+
+def _cp_for(dept, rnd):
+    if dept == "2A":
+        return f"201{rnd.randint(0, 99):02d}"
+    if dept == "2B":
+        return f"202{rnd.randint(0, 99):02d}"
+    return f"{dept}{rnd.randint(0, 999):03d}"
+
+
+def seed(dsn, stations=11000, seed_value=42):
+    import enrich_brands
+    import parse
+    import price_stats
+
+    rnd = random.Random(seed_value)
+    now = datetime.now().replace(microsecond=0)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            parse.ensure_schema(cur)
+            conn.commit()
+            enrich_brands.ensure_brand_columns(conn)
+            cur.execute("TRUNCATE stations, services, carburant_current CASCADE")
+            cur.execute("INSERT INTO import_generations (started_at, finished_at) VALUES (%s, %s) RETURNING id", (now, now))
+            generation = cur.fetchone()[0]
+
+            st_buf, px_buf = io.StringIO(), io.StringIO()
+            st_w, px_w = csv.writer(st_buf), csv.writer(px_buf)
+            prices = 0
+            for i in range(stations):
+                sid = 1000000 + i
+                dept = rnd.choice(DEPTS)
+                brand, short = rnd.choice(BRANDS)
+                st_w.writerow((
+                    sid, _cp_for(dept, rnd), f"VILLE {i % 3000}", f"{rnd.randint(1, 300)} RUE DU TEST",
+                    round(rnd.uniform(42.5, 51.0), 5), round(rnd.uniform(-4.5, 8.0), 5),
+                    int(rnd.random() < 0.3), brand, short, generation,
+                ))
+                for fuel, share, base in FUELS:
+                    if rnd.random() < share:
+                        maj = now - timedelta(minutes=rnd.randint(0, 4 * 24 * 60))
+                        px_w.writerow((sid, fuel, base + rnd.randint(-150, 150), now, maj, generation))
+                        prices += 1
+            st_buf.seek(0)
+            px_buf.seek(0)
+            cur.copy_expert(
+                "COPY stations (id, code_postal, ville, adresse, latitude, longitude, automate, "
+                "brand_name, brand_short_name, generation) FROM STDIN WITH (FORMAT csv)",
+                st_buf,
+            )
+            cur.copy_expert(
+                "COPY carburant_current (station_id, carburant, prix_milli, ts, updated_at, generation) "
+                "FROM STDIN WITH (FORMAT csv)",
+                px_buf,
+            )
+            cur.execute("UPDATE import_generations SET station_count = %s, price_count = %s WHERE id = %s",
+                        (stations, prices, generation))
+            price_stats.refresh_price_stats(cur, generation, full=True)
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE stations")
+            cur.execute("ANALYZE carburant_current")
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"[loadtest] seed OK: {stations} stations, {prices} prix")
+
+
+def build_snapshots(dsn):
+    import snapshots
+
+    # Toujours un répertoire jetable: jamais le SNAPSHOT_DIR réel (build prune les versions).
+    os.environ["SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="loadtest-snapshots-")
+    conn = psycopg2.connect(dsn)
+    try:
+        snapshots.build_snapshots(conn, keep=1)
+    finally:
+        conn.close()
+
+
+def _parse_mix(spec):
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition(":")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def _make_path(kind, rnd):
+    dept = rnd.choice(DEPTS)
+    if kind == "full":
+        return "/stations"
+    if kind == "limit":
+        return f"/stations?limit={rnd.choice((20, 50, 100))}"
+    if kind == "dept":
+        return f"/stations?dept={dept}&fields=id,ville,latitude,longitude,carburants"
+    if kind == "fuel":
+        lat, lon = rnd.uniform(43, 50), rnd.uniform(-2, 7)
+        return f"/stations?carburant=Gazole&bbox={lat:.2f},{lon:.2f},{lat + 0.5:.2f},{lon + 0.5:.2f}"
+    if kind == "stats":
+        return f"/stats?carburant=Gazole&dept={dept}"
+    if kind == "snapshot":
+        return f"/snapshot/{dept}"
+    raise SystemExit(f"[loadtest] type de requête inconnu: {kind}")
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _start_wsgi(app, port):
+    server = make_server("127.0.0.1", port, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _worker(mode, base_url, app, mix, deadline, results, seed_value):
+    rnd = random.Random(seed_value)
+    kinds, weights = zip(*mix)
+    if mode == "inprocess":
+        client = app.test_client()
+        get = lambda path: client.get(path, headers={"Accept-Encoding": "gzip"})
+    else:
+        session = requests.Session()
+        get = lambda path: session.get(base_url + path, headers={"Accept-Encoding": "gzip"})
+    while time.monotonic() < deadline:
+        kind = rnd.choices(kinds, weights)[0]
+        path = _make_path(kind, rnd)
+        t0 = time.perf_counter()
+        resp = get(path)
+        body = resp.data if mode == "inprocess" else resp.content
+        elapsed = (time.perf_counter() - t0) * 1000
+        timings = dict((k, float(v)) for k, v in _TIMING_RE.findall(resp.headers.get("Server-Timing", "")))
+        results.append((kind, resp.status_code, elapsed, timings.get("db"), timings.get("ser"), len(body)))
+
+
+def _pct(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _summarize(results, duration):
+    lat = sorted(r[2] for r in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r[1] >= 400),
+        "rps": len(results) / duration,
+        "p50_ms": _pct(lat, 50),
+        "p95_ms": _pct(lat, 95),
+        "p99_ms": _pct(lat, 99),
+        "db_ms": _mean([r[3] for r in results]),
+        "ser_ms": _mean([r[4] for r in results]),
+        "mb_out": sum(r[5] for r in results) / 1e6,
+    }
+
+
+def _fmt(v, spec=".1f"):
+    return "—" if v is None else format(v, spec)
+
+
+def run(mode, levels, duration, mix, port=8765):
+    import app as api
+
+    base_url = f"http://127.0.0.1:{port}"
+    server = _start_wsgi(api.app, port) if mode == "wsgi" else None
+    report = []
+    try:
+        for level in levels:
+            results = []
+            deadline = time.monotonic() + duration
+            threads = [
+                threading.Thread(target=_worker, args=(mode, base_url, api.app, mix, deadline, results, i))
+                for i in range(level)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            summary = _summarize(results, duration)
+            per_kind = {
+                kind: _summarize([r for r in results if r[0] == kind], duration)
+                for kind in sorted({r[0] for r in results})
+            }
+            report.append({"mode": mode, "concurrency": level, **summary, "by_kind": per_kind})
+            print(
+                f"[loadtest] {mode} c={level:<3} rps={summary['rps']:8.1f} "
+                f"p50={_fmt(summary['p50_ms'])}ms p95={_fmt(summary['p95_ms'])}ms p99={_fmt(summary['p99_ms'])}ms "
+                f"db={_fmt(summary['db_ms'])}ms ser={_fmt(summary['ser_ms'], '.2f')}ms "
+                f"err={summary['errors']} out={summary['mb_out']:.1f}MB"
+            )
+            for kind, st in per_kind.items():
+                print(
+                    f"[loadtest]     {kind:<9} n={st['requests']:<6} p50={_fmt(st['p50_ms'])}ms "
+                    f"p95={_fmt(st['p95_ms'])}ms db={_fmt(st['db_ms'])}ms"
+                )
+    finally:
+        if server:
+            server.shutdown()
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description="Banc de charge de l'API Flask sur une base Postgres locale.")
+    p.add_argument("--seed", action="store_true", help="(Re)génère le jeu de données synthétique puis quitte")
+    p.add_argument("--stations", type=int, default=11000, help="Nombre de stations générées")
+    p.add_argument("--mode", choices=("inprocess", "wsgi"), default="inprocess")
+    p.add_argument("--concurrency", default="1,4,16", help="Niveaux de concurrence (liste)")
+    p.add_argument("--duration", type=float, default=15.0, help="Durée par niveau (secondes)")
+    p.add_argument("--mix", default=DEFAULT_MIX, help="Pondérations type:poids,… (full, limit, dept, fuel, stats, snapshot)")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--json", help="Écrit le rapport dans ce fichier (comparaison avant/après)")
+    args = p.parse_args()
+
+    dsn = _dsn()
+    _use_loadtest_db(dsn)
+    if args.seed:
+        seed(dsn, stations=args.stations)
+        return
+
+    mix = _parse_mix(args.mix)
+    if any(kind == "snapshot" for kind, _ in mix):
+        build_snapshots(dsn)
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    report = run(args.mode, levels, args.duration, mix, port=args.port)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[loadtest] rapport écrit: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,8 @@ import enrich_brands
 def assert_recent_import():
     """Échoue le job si on n'a pas d'import courant aujourd'hui (détecte les faux positifs)."""
     import psycopg2
-    conn = enrich_brands.get_db_conn()
+    # Réplica accepté seulement s'il a déjà l'import qui vient de se terminer.
+    conn = enrich_brands.get_read_conn(max_lag_generations=0)
     history_enabled = str(os.getenv("ENABLE_CARBURANTS_HISTORY") or "").strip().lower() in {"1", "true", "yes", "on"}
     with conn.cursor() as cur:
         if history_enabled:
@@ -38,7 +39,7 @@ def print_env_debug():
 
 def print_sample_with_brands(n=5):
     import psycopg2
-    conn = enrich_brands.get_db_conn()
+    conn = enrich_brands.get_read_conn()
     with conn.cursor() as cur:
         cur.execute("""
             SELECT id, ville, brand_name, brand_short_name
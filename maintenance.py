@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Fenêtre de maintenance unique (hors import), bornée par un budget de temps.
+
+Usage:
+  python maintenance.py
+
+Variables optionnelles:
+  MAINT_BUDGET_S=1800           -> budget total (secondes), VACUUM compris
+  MAINT_TRUNCATE_HISTORY=1      -> vide la table carburants après rattrapage de carburant_daily (remplace purge + dédup)
+  MAINT_DEDUP_ROWS_PER_S, MAINT_PURGE_ROWS_PER_S, MAINT_VACUUM_MB_PER_S -> débits estimés
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+import dedup_services_batch
+import enrich_brands
+import purge_carburants_batch
+import truncate_carburants_history
+
+
+REPORT_TABLES = ("stations", "services", "carburant_current", "carburants")
+MIN_SLICE_S = 30
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _table_stats(cur):
+    cur.execute(
+        """
+        SELECT c.relname, c.reltuples::bigint, pg_relation_size(c.oid), pg_indexes_size(c.oid),
+               COALESCE(s.n_dead_tup, 0)
+        FROM pg_class c
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE c.relkind = 'r' AND c.relnamespace = 'public'::regnamespace AND c.relname = ANY(%s)
+        """,
+        (list(REPORT_TABLES),),
+    )
+    return {
+        name: {"rows": rows, "table_bytes": tbytes, "index_bytes": ibytes, "dead": dead}
+        for (name, rows, tbytes, ibytes, dead) in cur.fetchall()
+    }
+
+
+def _print_sizes(label, stats):
+    print(f"[maint] tailles {label}:")
+    for name in REPORT_TABLES:
+        st = stats.get(name)
+        if st is None:
+            continue
+        print(
+            f"[maint]   {name:<18} rows~{st['rows']:<10} table={st['table_bytes'] / 1e6:8.1f}MB "
+            f"index={st['index_bytes'] / 1e6:8.1f}MB dead={st['dead']}"
+        )
+
+
+def _estimated_purge_rows(cur, retention_days):
+    cur.execute(
+        f"""
+        EXPLAIN (FORMAT JSON)
+        SELECT 1 FROM carburants
+        WHERE {purge_carburants_batch.EFFECTIVE_DATE} < (NOW()::date - %s)::timestamp
+        """,
+        (retention_days,),
+    )
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _dedup_guaranteed(cur, spec):
+    """Vrai si un index unique valide couvre déjà la clé de dédup: aucun doublon possible."""
+    cur.execute(
+        """
+        SELECT EXISTS (
+          SELECT 1 FROM pg_index i
+          WHERE i.indexrelid = to_regclass(%s)
+            AND i.indrelid = to_regclass(%s)
+            AND i.indisunique AND i.indisvalid
+        )
+        """,
+        (spec["unique_index"], spec["table"]),
+    )
+    return cur.fetchone()[0]
+
+
+def _run_carburants_dedup(deadline):
+    conn = enrich_brands.get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            deleted, _ = dedup_services_batch.keyset_dedup(
+                cur,
+                dedup_services_batch.CARBURANTS_DEDUP,
+                range_rows=int(os.getenv("CARBURANTS_DEDUP_RANGE_ROWS", "20000")),
+                commit=conn.commit,
+                sleep_s=float(os.getenv("DEDUP_SLEEP_S", "0.3")),
+                deadline=deadline,
+                log_prefix="[maint]",
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
+
+
+def _run_purge(deadline):
+    purge_carburants_batch.create_effective_date_index()
+    return purge_carburants_batch.purge_batch(
+        batch_size=int(os.getenv("PURGE_BATCH_SIZE", "5000")),
+        sleep_s=float(os.getenv("PURGE_SLEEP_S", "0.3")),
+        retention_days=int(os.getenv("PURGE_RETENTION_DAYS", "30")),
+        target_batch_s=float(os.getenv("PURGE_TARGET_BATCH_S", "0.5")),
+        max_lock_waiters=purge_carburants_batch._env_opt("PURGE_MAX_LOCK_WAITERS", int),
+        max_replica_lag_s=purge_carburants_batch._env_opt("PURGE_MAX_REPLICA_LAG_S", float),
+        deadline=deadline,
+    )
+
+
+def _run_services_dedup(deadline):
+    deleted, _ = dedup_services_batch.dedup_batch(
+        range_rows=int(os.getenv("DEDUP_RANGE_ROWS", "5000")),
+        sleep_s=float(os.getenv("DEDUP_SLEEP_S", "0.3")),
+        deadline=deadline,
+    )
+    return deleted
+
+
+def _run_truncate(deadline):
+    truncate_carburants_history.main()
+    return 0
+
+
+def plan_tasks(cur, stats):
+    """Liste ordonnée (nom, table, lignes estimées, secondes estimées, fonction)."""
+    dedup_rate = float(os.getenv("MAINT_DEDUP_ROWS_PER_S", "50000"))
+    purge_rate = float(os.getenv("MAINT_PURGE_ROWS_PER_S", "20000"))
+    tasks = []
+    has_history = "carburants" in stats
+
+    if has_history and _env_flag("MAINT_TRUNCATE_HISTORY"):
+        tasks.append(("truncate_history", "carburants", stats["carburants"]["rows"], 1.0, _run_truncate))
+    elif has_history:
+        rows = _estimated_purge_rows(cur, int(os.getenv("PURGE_RETENTION_DAYS", "30")))
+        tasks.append(("purge_carburants", "carburants", rows, rows / purge_rate, _run_purge))
+        if _dedup_guaranteed(cur, dedup_services_batch.CARBURANTS_DEDUP):
+            print("[maint] dedup_carburants inutile: index unique valide présent.")
+        else:
+            rows = stats["carburants"]["rows"]
+            tasks.append(("dedup_carburants", "carburants", rows, rows / dedup_rate, _run_carburants_dedup))
+    if "services" in stats:
+        if _dedup_guaranteed(cur, dedup_services_batch.SERVICES_DEDUP):
+            print("[maint] dedup_services inutile: index unique valide présent.")
+        else:
+            rows = stats["services"]["rows"]
+            tasks.append(("dedup_services", "services", rows, rows / dedup_rate, _run_services_dedup))
+    return tasks
+
+
+def vacuum_analyze(tables):
+    conn = enrich_brands.get_db_conn()
+    conn.autocommit = True  # VACUUM interdit en transaction
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                t0 = time.monotonic()
+                cur.execute(f"VACUUM (ANALYZE) {table}")
+                print(f"[maint] VACUUM (ANALYZE) {table} ({time.monotonic() - t0:.1f}s)")
+    finally:
+        conn.close()
+
+
+def main():
+    load_dotenv()
+    budget_s = float(os.getenv("MAINT_BUDGET_S", "1800"))
+    vacuum_rate = float(os.getenv("MAINT_VACUUM_MB_PER_S", "50")) * 1e6
+    started = time.monotonic()
+    end = started + budget_s
+
+    print(f"[maint] start {datetime.utcnow().isoformat()}Z budget={budget_s:.0f}s")
+
+    conn = enrich_brands.get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            before = _table_stats(cur)
+            tasks = plan_tasks(cur, before)
+        conn.commit()
+    finally:
+        conn.close()
+    _print_sizes("avant", before)
+
+    # Réserve pour le VACUUM des tables potentiellement touchées.
+    vacuum_reserve = sum(
+        before[t]["table_bytes"] / vacuum_rate for t in {task[1] for task in tasks} if t in before
+    )
+    task_end = end - vacuum_reserve
+    for name, table, rows, est_s, _ in tasks:
+        print(f"[maint] plan {name}: rows~{rows} est~{est_s:.0f}s")
+    print(f"[maint] réserve VACUUM~{vacuum_reserve:.0f}s")
+
+    touched = []
+    for name, table, rows, est_s, fn in tasks:
+        remaining = task_end - time.monotonic()
+        if remaining < min(est_s, MIN_SLICE_S):
+            print(f"[maint] SKIP {name}: budget restant {remaining:.0f}s < estimation {est_s:.0f}s")
+            continue
+        if est_s > remaining:
+            print(f"[maint] {name}: passe partielle ({remaining:.0f}s), reprise au prochain run")
+        t0 = time.monotonic()
+        deleted = fn(task_end)
+        print(f"[maint] {name} terminé: deleted={deleted} ({time.monotonic() - t0:.1f}s)")
+        # TRUNCATE rend déjà l'espace: seul un DELETE justifie un VACUUM.
+        if deleted and table not in touched:
+            touched.append(table)
+
+    if touched:
+        vacuum_analyze(touched)
+    else:
+        print("[maint] aucune table modifiée, VACUUM inutile.")
+
+    conn = enrich_brands.get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            after = _table_stats(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    _print_sizes("après", after)
+    print(f"[maint] DONE en {time.monotonic() - started:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 # parse.py
-import xml.etree.ElementTree as ET
 import psycopg2
 from psycopg2.extras import execute_batch, execute_values
 import os
-import re
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from pathlib import Path
 
-def _clean(txt: str) -> str:
-    # Nettoie basiquement les textes XML pour éliminer les espaces multiples.
-    return re.sub(r'\s+', ' ', (txt or '').strip())
+import columnar
+from departements import dept_sql
+import price_stats
+import rollup_daily
+import shadow_current
+import snapshots
 
 def _env_flag(name: str, default: bool = False) -> bool:
     value = os.getenv(name)
@@ -18,25 +19,101 @@ def _env_flag(name: str, default: bool = False) -> bool:
     return value.strip().lower() in {"1", "true", "yes", "on"}
 
 def _run_carburants_dedup(cur):
+    from dedup_services_batch import CARBURANTS_DEDUP, keyset_dedup
+
     print("[parse] Maintenance: dédup globale carburants…")
-    cur.execute("""
-        WITH ranked AS (
-          SELECT ctid,
-                 ROW_NUMBER() OVER (
-                   PARTITION BY station_id, carburant, (COALESCE(date_maj, date_import)::date)
-                   ORDER BY date_maj DESC NULLS LAST, date_import DESC, ctid DESC
-                 ) AS rn
-          FROM carburants
-        )
-        DELETE FROM carburants
-        WHERE ctid IN (SELECT ctid FROM ranked WHERE rn > 1)
-    """)
-    deleted = cur.rowcount
+    range_rows = int(os.getenv("CARBURANTS_DEDUP_RANGE_ROWS", "20000"))
+    # Pas de commit intermédiaire: on reste dans la transaction d'import. Passe complète
+    # sous un job distinct pour ne pas consommer la reprise de maintenance.py.
+    deleted, _ = keyset_dedup(
+        cur,
+        CARBURANTS_DEDUP,
+        job="dedup:carburants:import",
+        range_rows=range_rows,
+        resume=False,
+        log_prefix="[parse]",
+    )
     if deleted > 0:
         print(f"[parse] Doublons carburants supprimés: {deleted}")
     else:
         print("[parse] Aucun doublon carburants à supprimer.")
 
+def ensure_schema(cur):
+    """DDL du chemin principal (CREATE d'abord, puis ALTER) — idempotent."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stations (
+          id INTEGER PRIMARY KEY,
+          code_postal TEXT,
+          ville TEXT,
+          adresse TEXT,
+          latitude DOUBLE PRECISION,
+          longitude DOUBLE PRECISION,
+          automate INTEGER
+        )
+    """)
+    # Si table existante sans 'adresse'
+    cur.execute("ALTER TABLE stations ADD COLUMN IF NOT EXISTS adresse TEXT")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS services (
+          station_id INTEGER REFERENCES stations(id),
+          service    TEXT,
+          date_import TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carburant_current (
+          station_id INTEGER NOT NULL,
+          carburant  TEXT NOT NULL,
+          prix_milli INTEGER NOT NULL,
+          ts TIMESTAMP NOT NULL,
+          updated_at TIMESTAMP,
+          PRIMARY KEY (station_id, carburant)
+        )
+    """)
+    cur.execute("ALTER TABLE carburant_current ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP")
+
+    # Index utiles (idempotents)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_services_station ON services(station_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_services_date ON services(date_import)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_services_station_service ON services(station_id, service)")
+
+    # Générations d'import: chaque ligne modifiée est estampillée par l'import qui l'a changée
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_generations (
+          id BIGSERIAL PRIMARY KEY,
+          started_at TIMESTAMP NOT NULL,
+          finished_at TIMESTAMP,
+          station_count INTEGER,
+          price_count INTEGER,
+          changed_count INTEGER
+        )
+    """)
+    cur.execute("ALTER TABLE stations ADD COLUMN IF NOT EXISTS generation BIGINT")
+    cur.execute("ALTER TABLE carburant_current ADD COLUMN IF NOT EXISTS generation BIGINT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stations_generation ON stations(generation)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carburant_current_generation ON carburant_current(generation)")
+
+    # Index des filtres /stations (cp, dept, bbox, automate, carburant)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stations_cp_prefix ON stations(code_postal text_pattern_ops)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_stations_dept ON stations({dept_sql('code_postal')})")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stations_lat_lon ON stations(latitude, longitude)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stations_automate ON stations(id) WHERE automate = 1")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carburant_current_carburant ON carburant_current(carburant, station_id)")
+
+def _finish_generation(cur, generation, snap, current_table="carburant_current"):
+    cur.execute(f"SELECT COUNT(*) FROM {current_table} WHERE generation = %s", (generation,))
+    changed_count = cur.fetchone()[0]
+    cur.execute(
+        """
+        UPDATE import_generations
+        SET finished_at = NOW(), station_count = %s, price_count = %s, changed_count = %s
+        WHERE id = %s
+        """,
+        (len(snap), snap.price_count, changed_count, generation),
+    )
+    print(f"[parse] Prix modifiés (génération {generation}): {changed_count}")
+
 def main():
     print("Début parsing...")
     now_utc = datetime.now(timezone.utc)
@@ -44,11 +121,13 @@ def main():
     enable_carburants_history = _env_flag("ENABLE_CARBURANTS_HISTORY", default=False)
     enable_carburants_dedup = _env_flag("ENABLE_CARBURANTS_DEDUP", default=False)
     enable_inline_retention_purge = _env_flag("ENABLE_INLINE_RETENTION_PURGE", default=False)
+    enable_shadow_import = _env_flag("ENABLE_SHADOW_IMPORT", default=False)
     print(
         "[parse] maintenance flags:",
         f"history={enable_carburants_history}",
         f"dedup={enable_carburants_dedup}",
         f"inline_purge={enable_inline_retention_purge}",
+        f"shadow={enable_shadow_import}",
     )
 
     # --- Résolution de chemin robuste (cron-proof)
@@ -82,44 +161,15 @@ def main():
         )
         cur = conn.cursor()
 
-        # --- DDL (CREATE d'abord, puis ALTER) — idempotent
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS stations (
-              id INTEGER PRIMARY KEY,
-              code_postal TEXT,
-              ville TEXT,
-              adresse TEXT,
-              latitude DOUBLE PRECISION,
-              longitude DOUBLE PRECISION,
-              automate INTEGER
-            )
-        """)
-        # Si table existante sans 'adresse'
-        cur.execute("ALTER TABLE stations ADD COLUMN IF NOT EXISTS adresse TEXT")
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS services (
-              station_id INTEGER REFERENCES stations(id),
-              service    TEXT,
-              date_import TIMESTAMP
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS carburant_current (
-              station_id INTEGER NOT NULL,
-              carburant  TEXT NOT NULL,
-              prix_milli INTEGER NOT NULL,
-              ts TIMESTAMP NOT NULL,
-              updated_at TIMESTAMP,
-              PRIMARY KEY (station_id, carburant)
-            )
-        """)
-        cur.execute("ALTER TABLE carburant_current ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP")
-
-        # Index utiles (idempotents)
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_services_station ON services(station_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_services_date ON services(date_import)")
-        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_services_station_service ON services(station_id, service)")
+        # --- DDL — idempotent
+        ensure_schema(cur)
+        rollup_daily.ensure_rollup_table(cur)
+        cur.execute(
+            "INSERT INTO import_generations (started_at) VALUES (%s) RETURNING id",
+            (now_naive,),
+        )
+        generation = cur.fetchone()[0]
+        print(f"[parse] Génération d'import: {generation}")
 
         if enable_carburants_history:
             cur.execute("""
@@ -135,10 +185,13 @@ def main():
             cur.execute("CREATE INDEX IF NOT EXISTS idx_carburants_station ON carburants(station_id)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_carburants_date ON carburants(date_import)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_carburants_station_carb ON carburants(station_id, carburant)")
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS idx_carburants_effective_date ON carburants((COALESCE(date_maj, date_import)))"
+            )
             if enable_carburants_dedup:
                 _run_carburants_dedup(cur)
             else:
-                print("[parse] Skip dédup globale carburants dans l'import quotidien.")
+                print("[parse] Skip dédup globale carburants dans l'import quotidien (voir maintenance.py).")
             cur.execute("""
                 CREATE UNIQUE INDEX IF NOT EXISTS idx_carburants_station_fuel_day
                 ON carburants(station_id, carburant, (COALESCE(date_maj, date_import)::date))
@@ -147,204 +200,202 @@ def main():
         else:
             print("[parse] Historique carburants désactivé pour la base principale.")
 
-        # --- Parsing XML
-        tree = ET.parse(str(XML_PATH))
-        root = tree.getroot()
-
-        stations = []
-        station_rows = []
-        carburant_rows = []
-        carburant_current_rows = []
-        service_rows = []
-        missing_maj = 0
-        for pdv in root.findall("pdv"):
-            station = {
-                "id": int(pdv.get("id")),
-                "code_postal": pdv.get("cp"),
-                "latitude": float(pdv.get("latitude")) / 100000,
-                "longitude": float(pdv.get("longitude")) / 100000,
-                "ville": (pdv.findtext("ville", default="") or "").strip(),
-                "adresse": _clean(pdv.findtext("adresse", default="")),
-                "automate": False,
-                "services": [],
-                "carburants": {},
-            }
-
-            horaires = pdv.find("horaires")
-            if horaires is not None:
-                station["automate"] = (horaires.get("automate-24-24") == "1")
-
-            station["services"] = [
-                s.text.strip() for s in pdv.findall("services/service") if s.text
+        if enable_shadow_import:
+            # DDL + génération dans leur propre transaction courte: les ALTER (ACCESS
+            # EXCLUSIVE) ne restent pas tenus pendant la construction de la table fantôme.
+            conn.commit()
+
+        # --- Parsing XML (colonnes array, pas d'objet par prix)
+        snap = columnar.parse_xml(XML_PATH)
+        print(f"[parse] Stations parsées: {len(snap)}")
+        print(f"[parse] Carburants sans date_maj fiable: {snap.missing_maj}")
+
+        report = snap.validate()
+        if report["price_outliers"]:
+            sample = [
+                (snap.station_id[snap.price_station[i]], snap.fuels[snap.fuel[i]], snap.prix_milli[i])
+                for i in report["price_outliers"][:10]
             ]
+            print(f"[parse] WARN prix aberrants: {len(report['price_outliers'])} (ex: {sample})")
+        if report["bad_coords"]:
+            sample = [snap.station_id[i] for i in report["bad_coords"][:10]]
+            print(f"[parse] WARN coordonnées invalides: {len(report['bad_coords'])} (ex: {sample})")
 
-            for prix in pdv.findall("prix"):
-                nom = prix.get("nom")
-                val = prix.get("valeur")
-                if nom and val:
-                    maj_dt = None
-                    maj_str = prix.get("maj")
-                    if maj_str:
-                        try:
-                            maj_dt = datetime.strptime(maj_str, "%Y-%m-%d %H:%M:%S")
-                        except ValueError:
-                            maj_dt = None
-                    if maj_dt is None:
-                        missing_maj += 1
-                    station["carburants"][nom] = {"price": float(val.replace(",", ".")), "maj": maj_dt}
-
-            stations.append(station)
-            station_rows.append(
-                (
-                    station["id"],
-                    station["ville"],
-                    station["code_postal"],
-                    station["adresse"],
-                    station["latitude"],
-                    station["longitude"],
-                    int(station["automate"]),
+        try:
+            if enable_shadow_import:
+                # Table live intouchée: construction + validation hors ligne, puis commit.
+                # Tout le reste (stations, services, historique, stats, génération) part dans
+                # la transaction de bascule: les lecteurs voient l'import entier ou rien.
+                shadow_current.build(cur, snap, now_naive, generation)
+                shadow_current.validate(cur, snap, now_naive)
+                conn.commit()
+
+            # --- Upsert stations + dédup au jour pour carburants/services
+            if len(snap):
+                execute_batch(
+                    cur,
+                    """
+                    INSERT INTO stations (id, ville, code_postal, adresse, latitude, longitude, automate, generation)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET
+                      ville = EXCLUDED.ville,
+                      code_postal = EXCLUDED.code_postal,
+                      adresse = EXCLUDED.adresse,
+                      latitude = EXCLUDED.latitude,
+                      longitude = EXCLUDED.longitude,
+                      automate = EXCLUDED.automate,
+                      generation = EXCLUDED.generation
+                    WHERE
+                      stations.ville IS DISTINCT FROM EXCLUDED.ville
+                      OR stations.code_postal IS DISTINCT FROM EXCLUDED.code_postal
+                      OR stations.adresse IS DISTINCT FROM EXCLUDED.adresse
+                      OR stations.latitude IS DISTINCT FROM EXCLUDED.latitude
+                      OR stations.longitude IS DISTINCT FROM EXCLUDED.longitude
+                      OR stations.automate IS DISTINCT FROM EXCLUDED.automate
+                    """,
+                    snap.station_rows(generation),
+                    page_size=500,
                 )
-            )
-            for carb, info in station["carburants"].items():
-                maj_dt = info.get("maj") or now_naive
-                if enable_carburants_history:
-                    carburant_rows.append((station["id"], carb, info["price"], now_naive, maj_dt))
-                prix_milli = int(round(info["price"] * 1000))
-                carburant_current_rows.append((station["id"], carb, prix_milli, now_naive, maj_dt))
-            for svc in station["services"]:
-                service_rows.append((station["id"], svc, now_naive))
-
-        print(f"[parse] Stations parsées: {len(stations)}")
-        print(f"[parse] Carburants sans date_maj fiable: {missing_maj}")
-
-        # --- Upsert stations + dédup au jour pour carburants/services
-        if station_rows:
-            execute_batch(
-                cur,
-                """
-                INSERT INTO stations (id, ville, code_postal, adresse, latitude, longitude, automate)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE SET
-                  ville = EXCLUDED.ville,
-                  code_postal = EXCLUDED.code_postal,
-                  adresse = EXCLUDED.adresse,
-                  latitude = EXCLUDED.latitude,
-                  longitude = EXCLUDED.longitude,
-                  automate = EXCLUDED.automate
-                WHERE
-                  stations.ville IS DISTINCT FROM EXCLUDED.ville
-                  OR stations.code_postal IS DISTINCT FROM EXCLUDED.code_postal
-                  OR stations.adresse IS DISTINCT FROM EXCLUDED.adresse
-                  OR stations.latitude IS DISTINCT FROM EXCLUDED.latitude
-                  OR stations.longitude IS DISTINCT FROM EXCLUDED.longitude
-                  OR stations.automate IS DISTINCT FROM EXCLUDED.automate
-                """,
-                station_rows,
-                page_size=500,
-            )
 
-        if enable_carburants_history and carburant_rows:
-            execute_values(
-                cur,
-                """
-                INSERT INTO carburants (station_id, carburant, prix, date_import, date_maj) VALUES %s
-                ON CONFLICT (station_id, carburant, (COALESCE(date_maj, date_import)::date)) DO UPDATE SET
-                  prix = EXCLUDED.prix,
-                  date_maj = EXCLUDED.date_maj,
-                  date_import = EXCLUDED.date_import
-                WHERE
-                  carburants.date_maj IS NULL
-                  OR EXCLUDED.date_maj > carburants.date_maj
-                  OR (
-                    EXCLUDED.date_maj = carburants.date_maj
-                    AND carburants.prix IS DISTINCT FROM EXCLUDED.prix
-                  )
-                """,
-                carburant_rows,
-                page_size=5000,
-            )
-            print(f"{len(carburant_rows)} carburants upsert tentés")
-        elif not enable_carburants_history:
-            print("[parse] Skip écriture historique carburants.")
-
-        if carburant_current_rows:
-            execute_values(
-                cur,
-                """
-                INSERT INTO carburant_current (station_id, carburant, prix_milli, ts, updated_at) VALUES %s
-                ON CONFLICT (station_id, carburant) DO UPDATE SET
-                  prix_milli = EXCLUDED.prix_milli,
-                  ts = EXCLUDED.ts,
-                  updated_at = EXCLUDED.updated_at
-                WHERE
-                  carburant_current.updated_at IS NULL
-                  OR EXCLUDED.updated_at > carburant_current.updated_at
-                  OR (
-                    EXCLUDED.updated_at = carburant_current.updated_at
-                    AND carburant_current.prix_milli IS DISTINCT FROM EXCLUDED.prix_milli
-                  )
-                """,
-                carburant_current_rows,
-                page_size=5000,
-            )
+            if enable_carburants_history and snap.price_count:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO carburants (station_id, carburant, prix, date_import, date_maj) VALUES %s
+                    ON CONFLICT (station_id, carburant, (COALESCE(date_maj, date_import)::date)) DO UPDATE SET
+                      prix = EXCLUDED.prix,
+                      date_maj = EXCLUDED.date_maj,
+                      date_import = EXCLUDED.date_import
+                    WHERE
+                      carburants.date_maj IS NULL
+                      OR EXCLUDED.date_maj > carburants.date_maj
+                      OR (
+                        EXCLUDED.date_maj = carburants.date_maj
+                        AND carburants.prix IS DISTINCT FROM EXCLUDED.prix
+                      )
+                    """,
+                    snap.history_rows(now_naive),
+                    page_size=5000,
+                )
+                print(f"{snap.price_count} carburants upsert tentés")
+            elif not enable_carburants_history:
+                print("[parse] Skip écriture historique carburants.")
 
-        if service_rows:
-            execute_values(
-                cur,
-                """
-                INSERT INTO services (station_id, service, date_import) VALUES %s
-                ON CONFLICT (station_id, service) DO NOTHING
-                """,
-                service_rows,
-                page_size=5000,
-            )
-            print(f"{len(service_rows)} services insert tentés")
-
-        # --- Métriques de fin d'import
-        imported_station_count = len({row[0] for row in carburant_current_rows})
-        today_row = (
-            now_naive.date(),
-            now_naive,
-            len(carburant_current_rows),
-            imported_station_count,
-        )
-        print(f"[parse] Contrôle carburants: {today_row}")
+            if not enable_shadow_import and snap.price_count:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO carburant_current (station_id, carburant, prix_milli, ts, updated_at, generation) VALUES %s
+                    ON CONFLICT (station_id, carburant) DO UPDATE SET
+                      prix_milli = EXCLUDED.prix_milli,
+                      ts = EXCLUDED.ts,
+                      updated_at = EXCLUDED.updated_at,
+                      generation = EXCLUDED.generation
+                    WHERE
+                      carburant_current.updated_at IS NULL
+                      OR EXCLUDED.updated_at > carburant_current.updated_at
+                      OR (
+                        EXCLUDED.updated_at = carburant_current.updated_at
+                        AND carburant_current.prix_milli IS DISTINCT FROM EXCLUDED.prix_milli
+                      )
+                    """,
+                    snap.current_rows(now_naive, generation),
+                    page_size=5000,
+                )
 
-        # Purge courte durée: 30 jours max, mais seulement si la table n'est pas trop grosse
-        if enable_carburants_history and enable_inline_retention_purge:
-            retention_cutoff = now_naive - timedelta(days=30)
-            cur.execute(
-                """
-                SELECT COUNT(*)
-                FROM carburants
-                WHERE COALESCE(date_maj, date_import) < %s
-                """,
-                (retention_cutoff,),
-            )
-            purge_candidates = cur.fetchone()[0] or 0
-        else:
-            purge_candidates = 0
+            # Agrégats journaliers depuis le flux (indépendants de l'historique brut)
+            rollup_daily.upsert_feed(cur, snap, now_naive)
 
-        if enable_carburants_history and enable_inline_retention_purge and purge_candidates <= 1_000_000:
-            print("Purge 30j lancée")
-            cur.execute("""
-                DELETE FROM carburants
-                WHERE COALESCE(date_maj, date_import) < NOW() - INTERVAL '30 days'
-            """)
-            print(f"[parse] Purge carburants 30j OK (candidats avant={purge_candidates})")
-        elif enable_carburants_history and enable_inline_retention_purge:
-            print("Purge 30j skippée")
-            print(
-                f"[parse] Purge carburants SKIP (candidats={purge_candidates} > 1_000_000). "
-                "Utilise une purge progressive par batch."
+            if snap.service_count:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO services (station_id, service, date_import) VALUES %s
+                    ON CONFLICT (station_id, service) DO NOTHING
+                    """,
+                    snap.service_rows(now_naive),
+                    page_size=5000,
+                )
+                print(f"{snap.service_count} services insert tentés")
+
+            # --- Métriques de fin d'import
+            today_row = (
+                now_naive.date(),
+                now_naive,
+                snap.price_count,
+                snap.priced_station_count,
             )
-        elif not enable_carburants_history:
-            print("[parse] Aucune maintenance historique: table carburants hors chemin principal.")
-        else:
-            print("[parse] Skip purge 30j inline dans l'import quotidien.")
-            print("[parse] Maintenance conseillée: lancer purge_carburants_batch.py hors import.")
+            print(f"[parse] Contrôle carburants: {today_row}")
+
+            if not enable_shadow_import:
+                _finish_generation(cur, generation, snap)
+                # --- Statistiques de prix (départements touchés seulement)
+                price_stats.refresh_price_stats(cur, generation)
+
+            # Purge courte durée: 30 jours max, mais seulement si la table n'est pas trop grosse
+            if enable_carburants_history and enable_inline_retention_purge:
+                # Aligné sur minuit: les jours purgés sont agrégés en entier juste avant.
+                retention_cutoff = rollup_daily.retention_cutoff(now_naive, 30)
+                cur.execute(
+                    """
+                    SELECT COUNT(*)
+                    FROM carburants
+                    WHERE COALESCE(date_maj, date_import) < %s
+                    """,
+                    (retention_cutoff,),
+                )
+                purge_candidates = cur.fetchone()[0] or 0
+            else:
+                purge_candidates = 0
+
+            if enable_carburants_history and enable_inline_retention_purge and purge_candidates <= 1_000_000:
+                print("Purge 30j lancée")
+                rollup_daily.rollup_before_purge(cur, retention_cutoff)
+                cur.execute(
+                    """
+                    DELETE FROM carburants
+                    WHERE COALESCE(date_maj, date_import) < %s
+                    """,
+                    (retention_cutoff,),
+                )
+                print(f"[parse] Purge carburants 30j OK (candidats avant={purge_candidates})")
+            elif enable_carburants_history and enable_inline_retention_purge:
+                print("Purge 30j skippée")
+                print(
+                    f"[parse] Purge carburants SKIP (candidats={purge_candidates} > 1_000_000). "
+                    "Utilise une purge progressive par batch (maintenance.py)."
+                )
+            elif not enable_carburants_history:
+                print("[parse] Aucune maintenance historique: table carburants hors chemin principal.")
+            else:
+                print("[parse] Skip purge 30j inline dans l'import quotidien.")
+                print("[parse] Maintenance conseillée: lancer maintenance.py hors import.")
+
+            if enable_shadow_import:
+                # Stats calculées sur la table fantôme; le verrou de bascule est pris en dernier
+                # et n'est tenu que jusqu'au commit.
+                price_stats.refresh_price_stats(cur, generation, current_table=shadow_current.SHADOW)
+                _finish_generation(cur, generation, snap, current_table=shadow_current.SHADOW)
+                shadow_current.swap(cur)
+
+            conn.commit()
+        except Exception:
+            if enable_shadow_import:
+                # Échec entre la construction et la bascule: rien de cet import n'est
+                # visible, on retire la génération et la table fantôme.
+                conn.rollback()
+                shadow_current.abandon(cur, generation)
+                conn.commit()
+            raise
+
+        # --- Artefacts statiques pour l'API (après commit: reflètent l'import validé)
+        if _env_flag("ENABLE_SNAPSHOTS", default=True):
+            try:
+                snapshots.build_snapshots(conn, keep=int(os.getenv("SNAPSHOT_KEEP", "3")))
+            except Exception as e:
+                conn.rollback()
+                print(f"[parse] WARN: génération des snapshots échouée: {e}")
 
-        conn.commit()
         conn.close()
         print("[parse] OK: mise en base terminée, logs ci-dessus.")
     except Exception as e:
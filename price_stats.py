@@ -0,0 +1,137 @@
+# price_stats.py
+"""Statistiques de prix par carburant, nationales (scope 'FR') et par département.
+
+Rafraîchies en fin d'import: seuls les départements touchés par la génération
+courante sont recalculés (plus le national), sinon une passe ensembliste complète.
+"""
+
+from departements import dept_sql
+
+NATIONAL = "FR"
+
+
+def ensure_stats_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carburant_stats (
+          scope TEXT NOT NULL,
+          carburant TEXT NOT NULL,
+          n INTEGER NOT NULL,
+          min_milli INTEGER NOT NULL,
+          avg_milli INTEGER NOT NULL,
+          p10_milli INTEGER NOT NULL,
+          median_milli INTEGER NOT NULL,
+          p90_milli INTEGER NOT NULL,
+          max_milli INTEGER NOT NULL,
+          generation BIGINT,
+          computed_at TIMESTAMP NOT NULL,
+          PRIMARY KEY (scope, carburant)
+        )
+    """)
+
+
+def _touched_depts(cur, generation, current_table):
+    """Départements touchés par la génération, ou None si une passe complète s'impose."""
+    cur.execute("SELECT EXISTS (SELECT 1 FROM carburant_stats)")
+    if not cur.fetchone()[0]:
+        return None
+    # Une station modifiée peut avoir changé de département: passe complète.
+    cur.execute("SELECT EXISTS (SELECT 1 FROM stations WHERE generation = %s)", (generation,))
+    if cur.fetchone()[0]:
+        return None
+    cur.execute(
+        f"""
+        SELECT DISTINCT {dept_sql("s.code_postal")}
+        FROM {current_table} c
+        JOIN stations s ON s.id = c.station_id
+        WHERE c.generation = %s
+        """,
+        (generation,),
+    )
+    return [r[0] for r in cur.fetchall() if r[0]]
+
+
+_AGGREGATES = """
+          COUNT(*),
+          MIN(d.prix_milli),
+          ROUND(AVG(d.prix_milli)),
+          ROUND(percentile_cont(0.1) WITHIN GROUP (ORDER BY d.prix_milli)),
+          ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY d.prix_milli)),
+          ROUND(percentile_cont(0.9) WITHIN GROUP (ORDER BY d.prix_milli)),
+          MAX(d.prix_milli),
+          %(generation)s,
+          NOW()
+"""
+_INSERT = """
+        INSERT INTO carburant_stats (
+          scope, carburant, n, min_milli, avg_milli, p10_milli, median_milli, p90_milli, max_milli,
+          generation, computed_at
+        )
+"""
+
+
+def refresh_price_stats(cur, generation, full=False, current_table="carburant_current"):
+    """current_table: table des prix courants à agréger (table fantôme avant bascule)."""
+    ensure_stats_table(cur)
+    depts = None if full else _touched_depts(cur, generation, current_table)
+    if depts is not None and not depts:
+        print("[stats] Aucun prix modifié: statistiques inchangées.")
+        return 0
+
+    params = {"generation": generation}
+    if depts is None:
+        # Passe ensembliste complète: départements et national en un seul parcours.
+        cur.execute("DELETE FROM carburant_stats")
+        cur.execute(
+            f"""{_INSERT}
+            SELECT
+              CASE WHEN GROUPING(d.dept) = 1 THEN '{NATIONAL}' ELSE d.dept END,
+              d.carburant,{_AGGREGATES}
+            FROM (
+              SELECT {dept_sql("s.code_postal")} AS dept, c.carburant, c.prix_milli
+              FROM {current_table} c
+              JOIN stations s ON s.id = c.station_id
+            ) d
+            GROUP BY GROUPING SETS ((d.dept, d.carburant), (d.carburant))
+            HAVING GROUPING(d.dept) = 1 OR d.dept IS NOT NULL
+            """,
+            params,
+        )
+        refreshed = cur.rowcount
+    else:
+        # Départements touchés: seules leurs stations sont lues (idx_stations_dept).
+        params["depts"] = depts
+        cur.execute("DELETE FROM carburant_stats WHERE scope = ANY(%s)", (depts,))
+        cur.execute(
+            f"""{_INSERT}
+            SELECT d.dept, d.carburant,{_AGGREGATES}
+            FROM (
+              SELECT {dept_sql("s.code_postal")} AS dept, c.carburant, c.prix_milli
+              FROM stations s
+              JOIN {current_table} c ON c.station_id = s.id
+              WHERE {dept_sql("s.code_postal")} = ANY(%(depts)s)
+            ) d
+            GROUP BY d.dept, d.carburant
+            """,
+            params,
+        )
+        refreshed = cur.rowcount
+        # National: les percentiles exigent toutes les lignes; même jointure que la passe
+        # complète pour que n et percentiles ne dépendent pas du chemin emprunté.
+        cur.execute("DELETE FROM carburant_stats WHERE scope = %s", (NATIONAL,))
+        cur.execute(
+            f"""{_INSERT}
+            SELECT '{NATIONAL}', d.carburant,{_AGGREGATES}
+            FROM (
+              SELECT c.carburant, c.prix_milli
+              FROM {current_table} c
+              JOIN stations s ON s.id = c.station_id
+            ) d
+            GROUP BY d.carburant
+            """,
+            params,
+        )
+        refreshed += cur.rowcount
+
+    scope = "complète" if depts is None else f"{len(depts)} département(s) + national"
+    print(f"[stats] Statistiques rafraîchies ({scope}): {refreshed} lignes")
+    return refreshed
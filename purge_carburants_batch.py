@@ -8,9 +8,74 @@ import psycopg2
 from dotenv import load_dotenv
 
 import enrich_brands
+import rollup_daily
 
 
-def purge_batch(batch_size=5000, sleep_s=0.3, max_batches=None):
+EFFECTIVE_DATE = "COALESCE(date_maj, date_import)"
+
+
+def create_effective_date_index():
+    conn = enrich_brands.get_db_conn()
+    conn.autocommit = True  # required for CONCURRENTLY
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carburants_effective_date
+                ON carburants(({EFFECTIVE_DATE}))
+                """
+            )
+    finally:
+        conn.close()
+
+
+def _lock_waiters(cur):
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM pg_stat_activity
+        WHERE datname = current_database() AND wait_event_type = 'Lock'
+        """
+    )
+    return cur.fetchone()[0] or 0
+
+
+def _replica_lag_s(cur):
+    cur.execute("SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication")
+    return float(cur.fetchone()[0] or 0)
+
+
+def _throttle(cur, max_lock_waiters, max_replica_lag_s, backoff_s, deadline=None):
+    """Attend tant que des sessions attendent des verrous ou que les réplicas sont en retard.
+
+    Retourne False si la deadline tombe avant que la charge ne redescende (purge à arrêter).
+    """
+    while True:
+        reasons = []
+        if max_lock_waiters is not None:
+            waiters = _lock_waiters(cur)
+            if waiters > max_lock_waiters:
+                reasons.append(f"lock_waiters={waiters}")
+        if max_replica_lag_s is not None:
+            lag = _replica_lag_s(cur)
+            if lag > max_replica_lag_s:
+                reasons.append(f"replica_lag={lag:.1f}s")
+        if not reasons:
+            return True
+        if deadline is not None and time.monotonic() + backoff_s >= deadline:
+            print(f"[purge] throttle ({', '.join(reasons)}) jusqu'à la deadline: arrêt.")
+            return False
+        print(f"[purge] throttle ({', '.join(reasons)}), pause {backoff_s}s")
+        time.sleep(backoff_s)
+
+
+def purge_batch(batch_size=5000, sleep_s=0.3, max_batches=None, retention_days=30,
+                target_batch_s=0.5, min_batch_size=500, max_batch_size=50000,
+                max_lock_waiters=None, max_replica_lag_s=None, throttle_backoff_s=2.0,
+                deadline=None):
+    """Purge par plages croissantes de COALESCE(date_maj, date_import) (idx_carburants_effective_date).
+
+    La taille de batch s'adapte pour que chaque DELETE tienne dans target_batch_s.
+    """
     conn = enrich_brands.get_db_conn()
     conn.autocommit = False
     total_deleted = 0
@@ -18,49 +83,106 @@ def purge_batch(batch_size=5000, sleep_s=0.3, max_batches=None):
 
     try:
         with conn.cursor() as cur:
-            while True:
+            # Cutoff figé au départ (le nombre de lignes restantes a un sens) et aligné sur
+            # minuit: chaque jour purgé a été rattrapé en entier dans carburant_daily.
+            cur.execute("SELECT (NOW()::date - %s)::timestamp", (retention_days,))
+            cutoff = cur.fetchone()[0]
+            cur.execute(f"SELECT COUNT(*), MIN({EFFECTIVE_DATE}) FROM carburants WHERE {EFFECTIVE_DATE} < %s", (cutoff,))
+            remaining, lower = cur.fetchone()
+            if remaining:
+                # Les tendances survivent à la purge: agrégats journaliers d'abord.
+                rollup_daily.rollup_before_purge(cur, cutoff)
+            conn.commit()
+            print(f"[purge] cutoff={cutoff} candidates={remaining}")
+
+            while remaining > 0 and lower is not None:
+                if not _throttle(cur, max_lock_waiters, max_replica_lag_s, throttle_backoff_s, deadline):
+                    conn.rollback()
+                    break
+
+                t0 = time.monotonic()
                 cur.execute(
-                    """
+                    f"""
                     WITH doomed AS (
                         SELECT ctid
                         FROM carburants
-                        WHERE COALESCE(date_maj, date_import) < NOW() - INTERVAL '30 days'
+                        WHERE {EFFECTIVE_DATE} >= %s AND {EFFECTIVE_DATE} < %s
+                        ORDER BY {EFFECTIVE_DATE}
                         LIMIT %s
                     )
                     DELETE FROM carburants
                     WHERE ctid IN (SELECT ctid FROM doomed)
-                    RETURNING 1
+                    RETURNING {EFFECTIVE_DATE}
                     """,
-                    (batch_size,),
+                    (lower, cutoff, batch_size),
                 )
-                deleted = cur.rowcount or 0
+                rows = cur.fetchall()
                 conn.commit()
+                elapsed = time.monotonic() - t0
+                deleted = len(rows)
                 total_deleted += deleted
+                remaining = max(remaining - deleted, 0)
                 batch += 1
+                if rows:
+                    # Keyset: on repart de la plus grande date supprimée (les ex aequo restants sont repris).
+                    lower = max(r[0] for r in rows)
 
-                print(f"[purge] batch {batch} deleted={deleted} total_deleted={total_deleted}")
+                print(
+                    f"[purge] batch {batch} size={batch_size} deleted={deleted} "
+                    f"total_deleted={total_deleted} remaining~{remaining} ({elapsed:.2f}s)"
+                )
 
                 if deleted < batch_size:
                     break
                 if max_batches is not None and batch >= max_batches:
                     break
+                if deadline is not None and time.monotonic() >= deadline:
+                    print("[purge] budget temps atteint.")
+                    break
+
+                # Taille adaptative: vise target_batch_s, variation bornée à x2 par batch.
+                if target_batch_s and elapsed > 0:
+                    factor = min(max(target_batch_s / elapsed, 0.5), 2.0)
+                    batch_size = int(min(max(batch_size * factor, min_batch_size), max_batch_size))
                 time.sleep(sleep_s)
     finally:
         conn.close()
 
     print(f"[purge] DONE total_deleted={total_deleted}")
+    return total_deleted
+
+
+def _env_opt(name, cast):
+    value = os.getenv(name)
+    return cast(value) if value else None
 
 
 def main():
     load_dotenv()
     batch_size = int(os.getenv("PURGE_BATCH_SIZE", "5000"))
     sleep_s = float(os.getenv("PURGE_SLEEP_S", "0.3"))
-    max_batches_env = os.getenv("PURGE_MAX_BATCHES")
-    max_batches = int(max_batches_env) if max_batches_env else None
+    max_batches = _env_opt("PURGE_MAX_BATCHES", int)
+    retention_days = int(os.getenv("PURGE_RETENTION_DAYS", "30"))
+    target_batch_s = float(os.getenv("PURGE_TARGET_BATCH_S", "0.5"))
+    max_lock_waiters = _env_opt("PURGE_MAX_LOCK_WAITERS", int)
+    max_replica_lag_s = _env_opt("PURGE_MAX_REPLICA_LAG_S", float)
 
     print(f"[purge] start {datetime.utcnow().isoformat()}Z")
-    print(f"[purge] batch_size={batch_size} sleep_s={sleep_s} max_batches={max_batches}")
-    purge_batch(batch_size=batch_size, sleep_s=sleep_s, max_batches=max_batches)
+    print(
+        f"[purge] batch_size={batch_size} sleep_s={sleep_s} max_batches={max_batches} "
+        f"target_batch_s={target_batch_s} max_lock_waiters={max_lock_waiters} max_replica_lag_s={max_replica_lag_s}"
+    )
+    print("[purge] creating effective date index concurrently...")
+    create_effective_date_index()
+    purge_batch(
+        batch_size=batch_size,
+        sleep_s=sleep_s,
+        max_batches=max_batches,
+        retention_days=retention_days,
+        target_batch_s=target_batch_s,
+        max_lock_waiters=max_lock_waiters,
+        max_replica_lag_s=max_replica_lag_s,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+# rollup_daily.py
+"""Agrégats journaliers OHLC (millièmes d'euro) par station et carburant.
+
+carburant_daily est alimentée par le flux à chaque import (upsert_feed), historique brut
+activé ou non: open au premier prix vu dans la journée, high/low/close suivis à chaque
+import, n_changes compte les changements de prix observés.
+
+L'historique brut carburants ne sert plus qu'au rattrapage (rollup_before_purge): avant une
+purge (cutoff aligné sur minuit, retention_cutoff) ou un TRUNCATE/DROP, les jours sont agrégés
+en entier sans écraser les lignes issues du flux, puis marqués dans carburant_daily_done
+pour ne jamais être relus depuis des lignes déjà partiellement purgées.
+"""
+
+from datetime import datetime, time, timedelta
+
+from psycopg2.extras import execute_values
+
+EFFECTIVE_DATE = "COALESCE(date_maj, date_import)"
+
+
+def retention_cutoff(now, retention_days=30):
+    """Cutoff de purge aligné sur minuit: les jours >= cutoff sont complets dans carburants."""
+    return datetime.combine((now - timedelta(days=retention_days)).date(), time.min)
+
+
+def ensure_rollup_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carburant_daily (
+          station_id INTEGER NOT NULL,
+          carburant  TEXT NOT NULL,
+          day DATE NOT NULL,
+          open_milli INTEGER NOT NULL,
+          high_milli INTEGER NOT NULL,
+          low_milli INTEGER NOT NULL,
+          close_milli INTEGER NOT NULL,
+          n_changes INTEGER NOT NULL,
+          PRIMARY KEY (station_id, carburant, day)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carburant_daily_day ON carburant_daily(day)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carburant_daily_done (
+          day DATE PRIMARY KEY,
+          rolled_at TIMESTAMP NOT NULL
+        )
+    """)
+
+
+def upsert_feed(cur, snap, now):
+    """Intègre les prix du flux au jour de leur date_maj; prix inchangé = ligne non réécrite."""
+    if not snap.price_count:
+        return 0
+    execute_values(
+        cur,
+        """
+        INSERT INTO carburant_daily (
+          station_id, carburant, day, open_milli, high_milli, low_milli, close_milli, n_changes
+        ) VALUES %s
+        ON CONFLICT (station_id, carburant, day) DO UPDATE SET
+          high_milli = GREATEST(carburant_daily.high_milli, EXCLUDED.close_milli),
+          low_milli = LEAST(carburant_daily.low_milli, EXCLUDED.close_milli),
+          close_milli = EXCLUDED.close_milli,
+          n_changes = carburant_daily.n_changes + 1
+        WHERE carburant_daily.close_milli <> EXCLUDED.close_milli
+        """,
+        snap.daily_rows(now),
+        template="(%s, %s, %s, %s, %s, %s, %s, 1)",
+        page_size=5000,
+    )
+    print(f"[rollup] {snap.price_count} prix du flux intégrés à carburant_daily")
+    return snap.price_count
+
+
+def _backfill_day(cur, day):
+    """Agrège un jour depuis carburants (plage d'un jour sur idx_carburants_effective_date).
+
+    Les lignes déjà alimentées par le flux sont conservées telles quelles.
+    """
+    cur.execute(
+        f"""
+        INSERT INTO carburant_daily (
+          station_id, carburant, day, open_milli, high_milli, low_milli, close_milli, n_changes
+        )
+        SELECT
+          station_id,
+          carburant,
+          %(day)s::date,
+          (array_agg(prix_milli ORDER BY eff))[1],
+          MAX(prix_milli),
+          MIN(prix_milli),
+          (array_agg(prix_milli ORDER BY eff DESC))[1],
+          COUNT(*)
+        FROM (
+          SELECT station_id, carburant, {EFFECTIVE_DATE} AS eff, ROUND(prix * 1000)::int AS prix_milli
+          FROM carburants
+          WHERE {EFFECTIVE_DATE} >= %(day)s::date
+            AND {EFFECTIVE_DATE} < %(day)s::date + 1
+            AND prix IS NOT NULL
+        ) src
+        GROUP BY station_id, carburant
+        ON CONFLICT (station_id, carburant, day) DO NOTHING
+        """,
+        {"day": day},
+    )
+    return cur.rowcount
+
+
+def rollup_before_purge(cur, cutoff=None):
+    """Rattrapage avant purge: agrège en entier les jours < cutoff pas encore finalisés.
+
+    cutoff=None: tout l'historique (avant TRUNCATE/DROP de carburants).
+    """
+    ensure_rollup_table(cur)
+    cur.execute(
+        f"""
+        SELECT MIN({EFFECTIVE_DATE}), COALESCE(%(cutoff)s, MAX({EFFECTIVE_DATE})::date + 1)
+        FROM carburants
+        WHERE %(cutoff)s IS NULL OR {EFFECTIVE_DATE} < %(cutoff)s
+        """,
+        {"cutoff": cutoff},
+    )
+    first, cutoff = cur.fetchone()
+    if first is None:
+        return 0
+    cur.execute(
+        """
+        SELECT d::date
+        FROM generate_series(%s::date, %s::date - 1, INTERVAL '1 day') d
+        WHERE NOT EXISTS (SELECT 1 FROM carburant_daily_done dd WHERE dd.day = d::date)
+        """,
+        (first, cutoff),
+    )
+    days = [r[0] for r in cur.fetchall()]
+    rows = 0
+    for day in days:
+        rows += _backfill_day(cur, day)
+        cur.execute(
+            "INSERT INTO carburant_daily_done (day, rolled_at) VALUES (%s, NOW()) ON CONFLICT (day) DO NOTHING",
+            (day,),
+        )
+    if days:
+        print(f"[rollup] {len(days)} jour(s) rattrapé(s) avant purge ({days[0]} → {days[-1]}): {rows} lignes")
+    return rows
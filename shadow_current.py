@@ -0,0 +1,162 @@
+# shadow_current.py
+"""Import de carburant_current via une table fantôme puis bascule atomique par RENAME.
+
+1. build(): COPY du flux dans une table temporaire, fusion avec la table live dans
+   carburant_current_shadow (mêmes règles que l'upsert), puis index recréés à l'identique.
+2. validate(): bornes sur le nombre de lignes (comme main.assert_recent_import).
+3. swap(): en fin de la transaction d'écriture (stations, services, historique, stats)
+   — LOCK, RENAME live -> _old, shadow -> live, DROP _old; verrou tenu jusqu'au commit.
+Les lecteurs ne voient jamais d'import partiel et la table chaude ne garde aucune ligne morte.
+"""
+
+import csv
+import io
+import os
+import re
+
+LIVE = "carburant_current"
+SHADOW = "carburant_current_shadow"
+OLD = "carburant_current_old"
+COLUMNS = "station_id, carburant, prix_milli, ts, updated_at, generation"
+
+
+def _live_indexes(cur):
+    cur.execute(
+        """
+        SELECT indexname, indexdef, (con.contype = 'p') AS is_pkey
+        FROM pg_indexes i
+        LEFT JOIN pg_constraint con ON con.conname = i.indexname AND con.conrelid = %s::regclass
+        WHERE i.schemaname = 'public' AND i.tablename = %s
+        """,
+        (LIVE, LIVE),
+    )
+    return cur.fetchall()
+
+
+def build(cur, snap, now, generation):
+    cur.execute(f"DROP TABLE IF EXISTS {SHADOW}")
+    cur.execute(f"CREATE TABLE {SHADOW} (LIKE {LIVE} INCLUDING DEFAULTS)")
+    cur.execute(
+        """
+        CREATE TEMP TABLE carburant_current_feed (
+          station_id INTEGER NOT NULL,
+          carburant  TEXT NOT NULL,
+          prix_milli INTEGER NOT NULL,
+          ts TIMESTAMP NOT NULL,
+          updated_at TIMESTAMP
+        ) ON COMMIT DROP
+        """
+    )
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in snap.current_rows(now, generation):
+        writer.writerow(row[:5])
+    buf.seek(0)
+    cur.copy_expert("COPY carburant_current_feed FROM STDIN WITH (FORMAT csv)", buf)
+
+    # Le flux l'emporte selon les mêmes règles que l'upsert; sinon la ligne live est conservée.
+    new_wins = """(
+        l.station_id IS NULL
+        OR l.updated_at IS NULL
+        OR f.updated_at > l.updated_at
+        OR (f.updated_at = l.updated_at AND l.prix_milli IS DISTINCT FROM f.prix_milli)
+    )"""
+    cur.execute(
+        f"""
+        INSERT INTO {SHADOW} ({COLUMNS})
+        SELECT f.station_id, f.carburant, f.prix_milli, f.ts, f.updated_at, %s
+        FROM carburant_current_feed f
+        LEFT JOIN {LIVE} l USING (station_id, carburant)
+        WHERE {new_wins}
+        UNION ALL
+        SELECT l.station_id, l.carburant, l.prix_milli, l.ts, l.updated_at, l.generation
+        FROM {LIVE} l
+        LEFT JOIN carburant_current_feed f USING (station_id, carburant)
+        WHERE f.station_id IS NULL OR NOT {new_wins}
+        """,
+        (generation,),
+    )
+    rows = cur.rowcount
+
+    # Index créés après chargement (plus rapide), suffixés _shadow jusqu'à la bascule.
+    for name, indexdef, is_pkey in _live_indexes(cur):
+        ddl = indexdef.replace(f" INDEX {name} ON ", f" INDEX {name}_shadow ON ", 1)
+        ddl = re.sub(rf" ON (public\.)?{LIVE} ", f" ON {SHADOW} ", ddl, count=1)
+        cur.execute(ddl)
+        if is_pkey:
+            cur.execute(f"ALTER TABLE {SHADOW} ADD CONSTRAINT {name}_shadow PRIMARY KEY USING INDEX {name}_shadow")
+    _grant_like_live(cur)
+    cur.execute(f"ANALYZE {SHADOW}")
+    print(f"[shadow] {SHADOW} construite: {rows} lignes")
+    return rows
+
+
+def validate(cur, snap, now):
+    """Lève RuntimeError si la table fantôme n'est pas plausible (l'import est alors annulé)."""
+    min_rows = int(os.getenv("SHADOW_MIN_ROWS", "1000"))
+    min_ratio = float(os.getenv("SHADOW_MIN_RATIO", "0.8"))
+
+    cur.execute(f"SELECT COUNT(*), MAX(ts) FROM {SHADOW}")
+    shadow_count, max_ts = cur.fetchone()
+    cur.execute(
+        """
+        SELECT price_count FROM import_generations
+        WHERE finished_at IS NOT NULL ORDER BY id DESC LIMIT 1
+        """
+    )
+    prev = cur.fetchone()
+    prev_count = prev[0] if prev and prev[0] else None
+
+    errors = []
+    if snap.price_count < min_rows:
+        errors.append(f"flux={snap.price_count} < SHADOW_MIN_ROWS={min_rows}")
+    if prev_count and snap.price_count < prev_count * min_ratio:
+        errors.append(f"flux={snap.price_count} < {min_ratio:.0%} de l'import précédent ({prev_count})")
+    if shadow_count < snap.price_count:
+        errors.append(f"shadow={shadow_count} < flux={snap.price_count}")
+    if max_ts is None or max_ts.date() < now.date():
+        errors.append(f"max(ts)={max_ts} n'est pas daté d'aujourd'hui")
+    if errors:
+        raise RuntimeError("validation shadow échouée: " + "; ".join(errors))
+    print(f"[shadow] validation OK: shadow={shadow_count} flux={snap.price_count} précédent={prev_count}")
+
+
+def _grant_like_live(cur):
+    """Reproduit les GRANT de la table live (LIKE ne les copie pas; ex. rôle lecture des réplicas)."""
+    cur.execute(
+        """
+        SELECT a.privilege_type,
+               CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(r.rolname) END
+        FROM pg_class c
+        CROSS JOIN LATERAL aclexplode(c.relacl) a
+        LEFT JOIN pg_roles r ON r.oid = a.grantee
+        WHERE c.oid = %s::regclass AND a.grantee <> c.relowner
+        """,
+        (LIVE,),
+    )
+    for privilege, grantee in cur.fetchall():
+        cur.execute(f"GRANT {privilege} ON {SHADOW} TO {grantee}")
+
+
+def abandon(cur, generation):
+    """Après échec d'import fantôme: supprime la table fantôme et la génération jamais publiée."""
+    cur.execute(f"DROP TABLE IF EXISTS {SHADOW}")
+    cur.execute("DELETE FROM import_generations WHERE id = %s AND finished_at IS NULL", (generation,))
+    print(f"[shadow] bascule abandonnée: génération {generation} retirée")
+
+
+def swap(cur):
+    """Bascule atomique; à appeler en dernier dans la transaction, commit immédiatement après."""
+    lock_timeout = os.getenv("SHADOW_LOCK_TIMEOUT", "5s")
+    cur.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+    live_indexes = [name for name, _, _ in _live_indexes(cur)]
+    cur.execute(f"LOCK TABLE {LIVE}, {SHADOW} IN ACCESS EXCLUSIVE MODE")
+    cur.execute(f"ALTER TABLE {LIVE} RENAME TO {OLD}")
+    for name in live_indexes:
+        cur.execute(f"ALTER INDEX {name} RENAME TO {name}_old")
+    cur.execute(f"ALTER TABLE {SHADOW} RENAME TO {LIVE}")
+    for name in live_indexes:
+        # Renomme aussi la contrainte PRIMARY KEY portée par l'index.
+        cur.execute(f"ALTER INDEX {name}_shadow RENAME TO {name}")
+    cur.execute(f"DROP TABLE {OLD}")
+    print(f"[shadow] bascule {SHADOW} -> {LIVE} OK")
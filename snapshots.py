@@ -0,0 +1,132 @@
+# snapshots.py
+"""Artefacts statiques pré-sérialisés (JSON gzip) du snapshot courant, servis tels quels par l'API.
+
+Arborescence (SNAPSHOT_DIR, défaut data/snapshots):
+  versions/<version>/all.json.gz
+  versions/<version>/dept/<code>.json.gz
+  versions/<version>/manifest.json
+  current -> versions/<version>   (lien symbolique basculé atomiquement)
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+from departements import dept_sql
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Même forme que /stations: colonnes stations + liste des prix courants.
+STATION_ROWS_SQL = """
+    SELECT
+      s.*,
+      COALESCE(
+        json_agg(
+          json_build_object(
+            'carburant', c.carburant,
+            'prix_euro', c.prix_milli / 1000.0,
+            'ts', c.ts
+          )
+        ) FILTER (WHERE c.carburant IS NOT NULL),
+        '[]'::json
+      ) AS carburants
+    FROM stations s
+    LEFT JOIN carburant_current c
+      ON c.station_id = s.id
+    GROUP BY s.id
+"""
+
+
+def snapshot_dir() -> Path:
+    return Path(os.getenv("SNAPSHOT_DIR", BASE_DIR / "data/snapshots"))
+
+
+def _write_gz(path: Path, items):
+    body = ("[" + ",".join(items) + "]").encode("utf-8")
+    # mtime=0: même contenu -> mêmes octets -> même ETag
+    data = gzip.compress(body, compresslevel=9, mtime=0)
+    path.write_bytes(data)
+    return {"etag": hashlib.sha256(data).hexdigest()[:32], "bytes": len(data), "raw_bytes": len(body)}
+
+
+def build_snapshots(conn, base_dir=None, keep=3):
+    """Construit une nouvelle version depuis stations + carburant_current et la rend courante."""
+    base = Path(base_dir) if base_dir else snapshot_dir()
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    versions = base / "versions"
+    target = versions / version
+    (target / "dept").mkdir(parents=True, exist_ok=True)
+
+    all_items = []
+    by_dept = {}
+    # Le JSON est produit par Postgres (::text): aucun décodage/réencodage Python.
+    with conn.cursor(name="snapshot_rows") as cur:
+        cur.itersize = 2000
+        cur.execute(
+            f"""
+            SELECT {dept_sql("t.code_postal")} AS dept, row_to_json(t)::text
+            FROM ({STATION_ROWS_SQL}) t
+            ORDER BY t.id
+            """
+        )
+        for dept, item in cur:
+            all_items.append(item)
+            if dept:
+                by_dept.setdefault(dept, []).append(item)
+    conn.commit()
+
+    files = {"all": _write_gz(target / "all.json.gz", all_items)}
+    for dept, items in by_dept.items():
+        files[f"dept/{dept}"] = _write_gz(target / "dept" / f"{dept}.json.gz", items)
+
+    manifest = {
+        "version": version,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "stations": len(all_items),
+        "files": files,
+    }
+    (target / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    # Bascule atomique du lien "current" (rename POSIX).
+    tmp_link = base / f".current.{os.getpid()}"
+    if tmp_link.is_symlink() or tmp_link.exists():
+        tmp_link.unlink()
+    tmp_link.symlink_to(Path("versions") / version)
+    os.replace(tmp_link, base / "current")
+
+    # Les fichiers déjà ouverts par l'API restent lisibles après suppression.
+    old = sorted(p for p in versions.iterdir() if p.is_dir() and p.name != version)
+    for p in old[: max(len(old) - (keep - 1), 0)]:
+        shutil.rmtree(p, ignore_errors=True)
+
+    print(
+        f"[snapshots] version={version} stations={len(all_items)} depts={len(by_dept)} "
+        f"all={files['all']['bytes'] / 1e6:.1f}MB gz"
+    )
+    return manifest
+
+
+_manifest_cache = {}
+
+
+def current_manifest(base_dir=None):
+    """Manifest de la version courante (mis en cache par cible du lien "current")."""
+    base = Path(base_dir) if base_dir else snapshot_dir()
+    current = base / "current"
+    try:
+        target = os.path.realpath(current)
+    except OSError:
+        return None, None
+    cached = _manifest_cache.get(str(base))
+    if cached and cached[0] == target:
+        return target, cached[1]
+    try:
+        manifest = json.loads((Path(target) / "manifest.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None, None
+    _manifest_cache[str(base)] = (target, manifest)
+    return target, manifest
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """Purge complète de la table carburants historique.
 
+Les jours pas encore agrégés dans carburant_daily sont rattrapés avant de vider la table.
+
 Usage:
   python truncate_carburants_history.py
 
@@ -14,6 +16,7 @@ from datetime import datetime
 from dotenv import load_dotenv
 
 import enrich_brands
+import rollup_daily
 
 
 def _env_flag(name: str, default: bool = False) -> bool:
@@ -57,6 +60,9 @@ def main():
             before_relname, before_size = _size_pretty(cur)
             print(f"[truncate-history] before: table={before_relname} size={before_size}")
 
+            # Tendances conservées: tout l'historique encore présent passe dans carburant_daily.
+            rollup_daily.rollup_before_purge(cur)
+
             if drop_history:
                 cur.execute("DROP TABLE carburants")
             else: